@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import os
+import json
+import shutil
+import hashlib
+
+# bump when format of cached artifacts changes
+CACHE_VERSION = 1
+
+CACHE_DIR_DEFAULT  = os.environ.get('ESP32KNIFE_CACHE', os.path.join(os.path.expanduser("~"), ".cache", "esp32knife"))
+CACHE_SIZE_DEFAULT = 1024 # MB
+
+# artifacts paths are stored relative to this mark instead of real output file name
+FILENAME_MARK = "<<filename>>"
+
+TEXT_SUFFIXES = [".info", ".map"]
+
+
+class AnalysisCache:
+    """ On-disk content addressed cache of image analysis artifacts (.info, .map, .segN, .elf)
+
+        Entries are keyed by SHA-256 of the image data, chip, board config and analysis
+        context, least recently used entries are evicted when cache grows above max_size.
+    """
+    root = None
+    max_size = None
+    size = None # running total of cache size, None until cache is scanned
+
+    def __init__(self, root=CACHE_DIR_DEFAULT, max_size=CACHE_SIZE_DEFAULT*1024*1024):
+        self.root = root
+        self.max_size = max_size
+        self.board_digests = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def board_digest(self, board_ext_symbols, board_ext_segments):
+        """ Digest of board symbols and segments files, computed once per process """
+        bkey = (tuple(board_ext_symbols or []), tuple(board_ext_segments or []))
+        digest = self.board_digests.get(bkey, None)
+        if digest is None:
+            h = hashlib.sha256()
+            for fname in bkey[0]:
+                h.update(fname.encode())
+                h.update(file_digest(fname))
+            for seg in bkey[1]:
+                h.update(" ".join(seg).encode())
+                h.update(file_digest(seg[-1]))
+            digest = h.digest()
+            self.board_digests[bkey] = digest
+        return digest
+
+    def key(self, ctx, data, board_ext_symbols, board_ext_segments):
+        h = hashlib.sha256()
+        h.update("{} {} {} {}".format(CACHE_VERSION, ctx.chip, ctx.dram0_data_start, ctx.dram0_data_end).encode())
+        h.update(self.board_digest(board_ext_symbols, board_ext_segments))
+        h.update(data)
+        return h.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def load(self, key, filename):
+        """ Restore artifacts of entry as filename.* files, returns entry meta data or None on miss """
+        edir = self.entry_dir(key)
+        fmeta = os.path.join(edir, "meta.json")
+        try:
+            with open(fmeta, "rt") as f:
+                meta = json.load(f)
+            for suffix in meta["files"]:
+                src = os.path.join(edir, suffix)
+                dst = filename + suffix
+                if suffix in TEXT_SUFFIXES:
+                    with open(src, "rt") as fsrc, open(dst, "wt") as fdst:
+                        fdst.write(fsrc.read().replace(FILENAME_MARK, filename))
+                else:
+                    shutil.copyfile(src, dst)
+            os.utime(fmeta) # LRU
+        except (OSError, ValueError, KeyError):
+            return None # missed or evicted meanwhile
+        meta["log"] = meta["log"].replace(FILENAME_MARK, filename)
+        return meta
+
+    def store(self, key, filename, suffixes, meta):
+        """ Save filename.<suffix> artifacts with meta data (json serializable dict) """
+        edir = self.entry_dir(key)
+        if os.path.exists(edir):
+            return
+        # entry is built aside and renamed, concurrent workers may store the same key
+        tmpdir = os.path.join(self.root, "tmp.{}.{}".format(os.getpid(), key))
+        os.makedirs(tmpdir, exist_ok=True)
+        meta = dict(meta)
+        meta["files"] = suffixes
+        meta["log"] = meta["log"].replace(filename, FILENAME_MARK)
+        for suffix in suffixes:
+            src = filename + suffix
+            dst = os.path.join(tmpdir, suffix)
+            if suffix in TEXT_SUFFIXES:
+                with open(src, "rt") as fsrc, open(dst, "wt") as fdst:
+                    fdst.write(fsrc.read().replace(filename, FILENAME_MARK))
+            else:
+                shutil.copyfile(src, dst)
+        with open(os.path.join(tmpdir, "meta.json"), "wt") as f:
+            json.dump(meta, f)
+        os.makedirs(os.path.dirname(edir), exist_ok=True)
+        try:
+            os.rename(tmpdir, edir)
+        except OSError:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+        # cache is scanned only once and then when it grows above max_size, not on every store
+        if self.size is not None:
+            self.size += sum( os.path.getsize(os.path.join(edir, f)) for f in os.listdir(edir) )
+        if self.size is None or self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """ Remove least recently used entries until cache fits max_size, updates running size.
+            Entries stored by other processes are counted here, so the running size of a
+            process may lag behind until its next scan.
+        """
+        entries = []
+        total = 0
+        for d in os.listdir(self.root):
+            pdir = os.path.join(self.root, d)
+            if len(d) != 2 or not os.path.isdir(pdir):
+                continue
+            for key in os.listdir(pdir):
+                edir = os.path.join(pdir, key)
+                try:
+                    size = sum( os.path.getsize(os.path.join(edir, f)) for f in os.listdir(edir) )
+                    atime = os.path.getmtime(os.path.join(edir, "meta.json"))
+                except OSError:
+                    continue
+                entries.append((atime, size, edir))
+                total += size
+        entries.sort()
+        for atime, size, edir in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(edir, ignore_errors=True)
+            total -= size
+        self.size = total
+
+
+def file_digest(fname):
+    h = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            h.update(chunk)
+    return h.digest()
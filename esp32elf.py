@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import struct
+
+# ELF32 little endian constants used by writer
+ET_EXEC = 2
+EV_CURRENT = 1
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+PT_LOAD = 1
+
+EHDR = struct.Struct("<16sHHIIIIIHHHHHH")
+PHDR = struct.Struct("<IIIIIIII")
+SHDR = struct.Struct("<IIIIIIIIII")
+SYM = struct.Struct("<IIIBBH")
+
+E_IDENT = b"\x7fELF" + bytes([1, 1, EV_CURRENT, 0]) + bytes(8) # ELFCLASS32, ELFDATA2LSB, no OS ABI
+
+
+class ElfSection(object):
+    """ Section header and payload: list of buffers (memoryview, bytes, bytearray) written one by one """
+    def __init__(self, name, name_off, sh_type, flags=0, addr=0, link=0, info=0, addralign=1, entsize=0, chunks=None):
+        self.name = name
+        self.name_off = name_off # in .shstrtab
+        self.sh_type = sh_type
+        self.flags = flags
+        self.addr = addr
+        self.link = link
+        self.info = info
+        self.addralign = addralign
+        self.entsize = entsize
+        self.chunks = chunks if chunks is not None else []
+        self.offset = 0
+
+    @property
+    def size(self):
+        return sum( len(c) for c in self.chunks )
+
+
+class ElfWriter(object):
+    """ ELF32 little endian executable built in one pass: section payloads are kept as references
+        to image data, layout (same as makeelf: headers, then sections back to back) is planned
+        once before writing and payloads are streamed to file.
+        Section 0 is NULL, section 1 is .shstrtab.
+    """
+    def __init__(self, e_machine, e_entry=0):
+        self.e_machine = e_machine
+        self.e_entry = e_entry
+        self.shstrtab = bytearray(b'\0')
+        self.sections = [ ElfSection("", 0, 0, addralign=0) ]
+        self.segments = [] # [p_type, section index, vaddr, paddr, filesz, memsz, flags, align]
+        self.add_section(".shstrtab", [self.shstrtab], sh_type=SHT_STRTAB)
+        self.symtab = None
+        self.strtab = None
+
+    def add_section(self, name, chunks, addr=0, sh_type=SHT_PROGBITS, flags=0, link=0, info=0, addralign=1, entsize=0):
+        """ Append section with payload made of chunks, returns its index """
+        name_off = len(self.shstrtab)
+        self.shstrtab += name.encode() + b'\0'
+        self.sections.append(ElfSection(name, name_off, int(sh_type), int(flags), addr, link, info, addralign, entsize, chunks))
+        return len(self.sections) - 1
+
+    def section_by_name(self, name):
+        """ Index of section by name (the first one if there are several) """
+        for i, sec in enumerate(self.sections):
+            if i and sec.name == name:
+                return i
+        raise KeyError(name)
+
+    def add_strtab(self):
+        self.strtab = self.add_section(".strtab", [bytearray(b'\0')], sh_type=SHT_STRTAB)
+        return self.strtab
+
+    def add_symtab(self):
+        """ Append .symtab linked to .strtab, symbols go to the first one (as with makeelf) """
+        index = self.add_section(".symtab", [bytearray(SYM.size)], sh_type=SHT_SYMTAB, link=self.strtab, addralign=4, entsize=SYM.size)
+        if self.symtab is None:
+            self.symtab = index
+        return index
+
+    def add_symbol(self, name, shndx, value, size, binding, sym_type):
+        """ Append symbol (default visibility), returns its index """
+        strtab = self.sections[self.strtab].chunks[0]
+        symtab = self.sections[self.symtab]
+        name_off = len(strtab)
+        strtab += name.encode() + b'\0'
+        symtab.chunks[0] += SYM.pack(name_off, value, size, (int(sym_type) & 0xf) | (int(binding) << 4), 0, int(shndx))
+        index = len(symtab.chunks[0]) // SYM.size - 1
+        symtab.info = index + 1
+        return index
+
+    def add_segment(self, section, vaddr, size, flags, align, p_type=PT_LOAD):
+        """ Program header of segment starting at section (index) """
+        self.segments.append([p_type, section, vaddr, vaddr, size, size, int(flags), align])
+
+    def layout(self):
+        """ Assign file offsets of sections, returns file size """
+        cursor = EHDR.size + PHDR.size*len(self.segments) + SHDR.size*len(self.sections)
+        for sec in self.sections:
+            sec.offset = cursor
+            cursor += sec.size
+        return cursor
+
+    def headers(self):
+        """ Ehdr, Phdrs and Shdrs of planned layout """
+        phoff = EHDR.size if self.segments else 0
+        ehdr = EHDR.pack(E_IDENT, ET_EXEC, int(self.e_machine), EV_CURRENT, self.e_entry,
+                         phoff, EHDR.size + PHDR.size*len(self.segments), 0, EHDR.size,
+                         PHDR.size if self.segments else 0, len(self.segments), SHDR.size, len(self.sections), 1)
+        phdrs = b''.join( PHDR.pack(seg[0], self.sections[seg[1]].offset, *seg[2:]) for seg in self.segments )
+        shdrs = b''.join( SHDR.pack(sec.name_off, sec.sh_type, sec.flags, sec.addr, sec.offset, sec.size,
+                                    sec.link, sec.info, sec.addralign, sec.entsize) for sec in self.sections )
+        return ehdr + phdrs + shdrs
+
+    def write(self, filename):
+        """ Plan layout and stream headers and section payloads to file """
+        self.layout()
+        with open(filename, "wb") as f:
+            f.write(self.headers())
+            for sec in self.sections:
+                for chunk in sec.chunks:
+                    f.write(chunk)
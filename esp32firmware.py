@@ -7,6 +7,7 @@ import copy
 import hashlib
 import zlib, base64
 import esp32utils
+from esplog import printlog
 from esp32exceptions import *
 
 
@@ -46,7 +47,7 @@ class ESP_APP_DESC_STRUCT:
     def unpack(self, buffer):
         m = struct.unpack('<I', buffer[:4]) 
         if  m[0] != ESP_APP_DESC_MAGIC_WORD:
-            print("Failed unpack ESP_APP_DESC_STRUCT: wrong magic {:08x}".format(m[0]))
+            printlog("Failed unpack ESP_APP_DESC_STRUCT: wrong magic {:08x}".format(m[0]))
             return None
 
         magic_word, secure_version, reserv1, version, project_name, time, date, idf_ver, app_elf_sha256, reserv2 = struct.unpack( ESP_APP_DESC_STRUCT_FMT, buffer[:ESP_APP_DESC_STRUCT_SIZE] )
@@ -9,14 +9,18 @@ import argparse
 import time
 import shutil
 import struct
+import hashlib
 
-from espconsts import *
+import espconsts
 from esplog import *
 import esp32firmware as esp32
 import esp32partgen as esp32part
 import copy
 from makeelf.elf import *
 import esp32nvs
+import esp32cache
+import esp32symdb
+import esp32elf
 
 try:
     import serial.tools.list_ports as list_ports
@@ -29,13 +33,29 @@ from esp32exceptions import *
 from esp32utils import *
 import io
 import json
+import contextlib
+import concurrent.futures
+import multiprocessing
+import threading
+import glob
+import bisect
 
-FIRMWARE_CHIP = None
 FIRMWARE_ESP  = None
 
 FIRMWARE_PARTITIONS_TABLE_OFFSETS = [ 0x8000, 0x9000 ]
 FIRMWARE_PARTITIONS_TABLE_SIZE   = 0xC00
 
+# flash is compared by on-device MD5 (with reference dump or erased one) by blocks of this size
+FLASH_BLOCK_SIZE = 0x10000
+
+# full flash is read by chunks of this size checkpointed to partial file
+FLASH_CHUNK_SIZE = 0x40000
+FLASH_CHUNK_RETRIES = 5
+# consecutive chunk read errors before switching to lower baud rate
+FLASH_CHUNK_ERRORS_BAUD_DROP = 2
+
+BAUD_RATES = [ 3000000, 2000000, 1500000, 921600, 460800, 230400, 115200 ]
+
 DETECTED_FLASH_SIZES_STR = {    0x12: '256KB', 
                             0x13: '512KB', 
                             0x14: '1MB', 
@@ -59,8 +79,22 @@ def esp_flash_size(esp):
     size_id = flash_id >> 16
     return DETECTED_FLASH_SIZES_INT.get(size_id, None)
 
-DRAM0_DATA_START = None
-DRAM0_DATA_END   = None
+
+class AnalysisContext:
+    """ Per-job analysis state: target chip and DRAM0 data range seen in parsed images """
+    chip = None
+    dram0_data_start = None
+    dram0_data_end   = None
+
+    def __init__(self, chip):
+        self.chip = chip
+
+    def add_dram0_data(self, addr, size):
+        if self.dram0_data_start==None or addr<self.dram0_data_start:
+            self.dram0_data_start = addr
+        dend = addr + size
+        if self.dram0_data_end==None or dend > self.dram0_data_end:
+            self.dram0_data_end = dend
 
 # esptool\docs\en\advanced-topics\firmware-image-format.rst 
 # .. only:: esp8266
@@ -181,7 +215,7 @@ def esp8266_get_image_size(image):
     image_size += 1  # checksum
     return (image_size + 15) & ~15 # Align to 16 bytes
 
-def esp8266_analyze_firmware(flash, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS):
+def esp8266_analyze_firmware(ctx, flash, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS):
     """Special handling for ESP8266 firmware"""
     printlog("\nESP8266 Firmware Analysis")
     printlog("="*80)
@@ -202,16 +236,17 @@ def esp8266_analyze_firmware(flash, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS):
             continue
             
         printlog(f"\nTesting offset 0x{offset:x} for ESP8266 image")
-        fimage = flash[offset:]
+        fimage = bytes(flash[offset:])
         try:
             # image = ESP8266V2FirmwareImageRelaxed(fimage)
-            image = esptool.bin_image.LoadFirmwareImage("esp8266", fimage )
+            parsed = ParsedImage("esp8266", fimage)
+            image = parsed.image
             printlog(f"\nFound ESP8266 image at offset 0x{offset:x}")
                 
             # image_size = image.image_size()
-            image_size = esp8266_get_image_size(image);
+            image_size = parsed.size
             image_data = flash[offset:offset+image_size]
-            image_name = f"{BASEDIR_DIS}/image_0x{offset:x}.bin"
+            image_name = f"{espconsts.BASEDIR_DIS}/image_0x{offset:x}.bin"
             
             printlog(f"  Entry point: 0x{image.entrypoint:08x}")
             printlog(f"  Segments: {len(image.segments)}")
@@ -223,9 +258,8 @@ def esp8266_analyze_firmware(flash, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS):
             # Analyze the image
             printlog(f"\nImage at 0x{offset:x} info:")
             printlog("-"*40)
-            fparsed = flash_image_info('esp8266', image_data, image_name)
-            if fparsed:
-                export_bin2elf('ESP8266', image_data, image_name, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS)
+            if flash_image_info(ctx, image_data, image_name, parsed):
+                export_bin2elf(ctx, parsed, image_name, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS)
             
             images_found.append((offset, image_size, image_name))
                 
@@ -239,7 +273,7 @@ def esp8266_analyze_firmware(flash, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS):
     if 0x3FC000 < len(flash):
         if flash[0x3FC000:0x3FC004] == b'\x00\x00\xff\x00':
             printlog(f"Found RF calibration data at 0x3FC000")
-            rf_cal_file = f"{BASEDIR_DIS}/rf_cal_0x3fc000.bin"
+            rf_cal_file = f"{espconsts.BASEDIR_DIS}/rf_cal_0x3fc000.bin"
             with open(rf_cal_file, "wb") as f:
                 f.write(flash[0x3FC000:0x3FC000+0x1000])
     
@@ -249,9 +283,9 @@ def esp8266_analyze_firmware(flash, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS):
             continue
         
         # Look for K500 string which appears to be in your firmware
-        if b'K500' in flash[offset:offset+0x20]:
+        if b'K500' in bytes(flash[offset:offset+0x20]):
             printlog(f"Found system parameters (K500) at 0x{offset:x}")
-            param_file = f"{BASEDIR_DIS}/system_params_0x{offset:x}.bin"
+            param_file = f"{espconsts.BASEDIR_DIS}/system_params_0x{offset:x}.bin"
             with open(param_file, "wb") as f:
                 f.write(flash[offset:offset+0x1000])
     
@@ -259,7 +293,7 @@ def esp8266_analyze_firmware(flash, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS):
     if 0x3FF000 < len(flash):
         if flash[0x3FF000+4:0x3FF000+8] == b'\xaa\x55\xaa\x55':
             printlog(f"Found RF init data at 0x3FF000")
-            rf_init_file = f"{BASEDIR_DIS}/rf_init_0x3ff000.bin"
+            rf_init_file = f"{espconsts.BASEDIR_DIS}/rf_init_0x3ff000.bin"
             with open(rf_init_file, "wb") as f:
                 f.write(flash[0x3FF000:0x3FF000+0x1000])
     
@@ -268,11 +302,11 @@ def esp8266_analyze_firmware(flash, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS):
     for offset in range(len(flash) - 0x4000, len(flash), 0x1000):
         if offset < 0:
             continue
-        sector = flash[offset:offset+0x1000]
+        sector = bytes(flash[offset:offset+0x1000])
         # Look for common WiFi config patterns
         if b'ssid' in sector or b'password' in sector or b'SSID' in sector:
             printlog(f"Found potential WiFi configuration at 0x{offset:x}")
-            wifi_file = f"{BASEDIR_DIS}/wifi_config_0x{offset:x}.bin"
+            wifi_file = f"{espconsts.BASEDIR_DIS}/wifi_config_0x{offset:x}.bin"
             with open(wifi_file, "wb") as f:
                 f.write(sector)
     
@@ -283,6 +317,9 @@ def esp8266_analyze_firmware(flash, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS):
 def arg_auto_int(x):
     return int(x, 0)
 
+def arg_baud(x):
+    return x if x == 'auto' else arg_auto_int(x)
+
 def print_mac(label, mac):
     printlog('%s: %s' % (label, ':'.join(map(lambda x: '%02x' % x, mac))))
 
@@ -304,65 +341,81 @@ def memory_segment(image, segname):
             return seg
     return None
 
-def parse_nvs_partition(partfilename):
-    #cvs
+class ParsedImage(object):
+    """ Firmware image parsed once, shared by info, map, segments and ELF stages (read only):
+          image         - esptool image: header fields and segments
+          regions       - memory map regions names of every segment (in order of image.segments)
+          app_descs     - ESP_APP_DESC_STRUCT of every DROM segment, None for the rest
+          iram          - IRAM memory map entry
+          size          - real size of image in partition
+          calc_checksum - calculated checksum (image.checksum is stored one)
+          digest_valid  - appended SHA-256 digest matches, None if not appended
+    """
+    def __init__(self, chip, data):
+        self.chip = chip
+        self.image = esptool.bin_image.LoadFirmwareImage(chip, bytes(data))
+        image = self.image
+        memory_map = image.ROM_LOADER.MEMORY_MAP
+        self.regions = [ [ r[2] for r in memory_map if r[0] <= seg.addr < r[1] ] for seg in image.segments ]
+        self.app_descs = [ esp32.ESP_APP_DESC_STRUCT(seg.data) if "DROM" in names else None for seg, names in zip(image.segments, self.regions) ]
+        self.iram = memory_segment(image, "IRAM")
+        if chip == 'esp8266':
+            self.size = esp8266_get_image_size(image)
+        else:
+            self.size = image.data_length + len(image.stored_digest)
+        self.calc_checksum = image.calculate_checksum()
+        self.digest_valid = None
+        if getattr(image, "append_digest", False): # ESP8266 image has no append_digest field
+            self.digest_valid = image.stored_digest == image.calc_digest
+
+def parse_nvs_partition(partfilename, partdata):
+    # parsed once, rendered to all formats
+    nvs = esp32nvs.nvs_parse(partdata, verify=True)
+
+    report = io.StringIO()
+    esp32nvs.nvs_render_verify(nvs, report)
+    for line in report.getvalue().splitlines():
+        printlog("      " + line)
+
     logfilename=partfilename+".cvs"
     printlog("      Parsing NVS partition: {} to {}".format(partfilename, logfilename))
-    flog = open(logfilename, "wt")
-    with open(partfilename, 'rb') as fh:
-        std=sys.stdout
-        if flog: 
-            sys.stdout = flog
-        #pages = esp32nvs.read_nvs_pages(fh,True)
-        pages = esp32nvs.nvs2cvs(fh, NVS_BLOB_DATA_DIR)
-        sys.stdout = std
-
-    #text
+    with open(logfilename, "wt") as f:
+        esp32nvs.nvs_render_cvs(nvs, f, espconsts.NVS_BLOB_DATA_DIR)
+
     logfilename=partfilename+".txt"
     printlog("      Parsing NVS partition: {} to {}".format(partfilename, logfilename))
-    flog = open(logfilename, "wt")
-    with open(partfilename, 'rb') as fh:
-        std=sys.stdout
-        if flog: 
-            sys.stdout = flog
-        pages = esp32nvs.nvs2txt(fh)
-        sys.stdout = std
-
-    #json
+    with open(logfilename, "wt") as f:
+        esp32nvs.nvs_render_text(nvs, f)
+
     logfilename=partfilename+".json"
     printlog("      Parsing NVS partition: {} to {}".format(partfilename, logfilename))
-    with open(partfilename, 'rb') as fh:
-        sys.stdout = open(os.devnull, 'w') # block print()
-        pages = esp32nvs.nvs2txt(fh)
-        sys.stdout = sys.stdout = sys.__stdout__ # re-enable print()
-        with open(logfilename, "wt") as f:
-            f.writelines(json.dumps(pages, indent=4))
+    with open(logfilename, "wt") as f:
+        esp32nvs.nvs_render_json(nvs, f)
             
 
-def flash_image_info(chip, data, filename):
-    global DRAM0_DATA_START, DRAM0_DATA_END
+def flash_image_info(ctx, data, filename, parsed=None):
+    """ Write .info, .map and segments of image, returns ParsedImage (parsed from data if not given) or None if it can't be parsed """
+    chip = ctx.chip
 
     f_info=open("{}.info".format(filename),"wt+")
     f_map =open("{}.map".format(filename),"wt+")
 
-    try:
-        image = esptool.bin_image.LoadFirmwareImage(chip, data)
-    except Exception as inst:
-        printlog("Failed to parse : " + filename)
-        printlog(inst)
-        return False
-        
+    if parsed is None:
+        try:
+            parsed = ParsedImage(chip, data)
+        except Exception as inst:
+            printlog("Failed to parse : " + filename)
+            printlog(inst)
+            return None
+    image = parsed.image
+
     log(f_info, "Image version: {}".format( image.version ) )
     if image.entrypoint != 0:
         log(f_info, "Entry point: {:08x}".format(image.entrypoint))
     else:
         log(f_info, "Entry point not set")
     
-    if chip == 'esp8266':
-        image_size = esp8266_get_image_size(image)
-    else :
-        image_size = image.data_length + len(image.stored_digest)
-    log(f_info, "real partition size: {}".format(image_size))
+    log(f_info, "real partition size: {}".format(parsed.size))
     log(f_info, "flash_mode: {}".format(image.flash_mode))
     log(f_info, "flash_size_freq: {}".format(image.flash_size_freq))
     f_map.write("Entry: 0x{:x}\n".format(image.entrypoint))
@@ -376,18 +429,13 @@ def flash_image_info(chip, data, filename):
     log(f_info)
 
     idx = 0
-    for seg in image.segments:
+    for seg, regions, app_desc in zip(image.segments, parsed.regions, parsed.app_descs):
         idx += 1
-        log(f_info, "Segment {} : {} {}".format( idx, seg, get_seg_name(image, seg.addr)))
-        if if_addr_in_seg(image, seg.addr, "DRAM"):
-            if DRAM0_DATA_START==None or seg.addr<DRAM0_DATA_START:
-                DRAM0_DATA_START = seg.addr
-            dend = seg.addr + len(seg.data)
-            if DRAM0_DATA_END==None or dend > DRAM0_DATA_END:
-                DRAM0_DATA_END = dend
-        if if_addr_in_seg(image, seg.addr, "DROM"):
-            seg_app_data = esp32.ESP_APP_DESC_STRUCT(seg.data)
-            printlog("  DROM, app data: {}".format(seg_app_data))
+        log(f_info, "Segment {} : {} {}".format( idx, seg, ",".join(regions)))
+        if "DRAM" in regions:
+            ctx.add_dram0_data(seg.addr, len(seg.data))
+        if app_desc is not None:
+            printlog("  DROM, app data: {}".format(app_desc))
         #log(f_info, "  addr=0x{:x} file_offs=0x{:x} include_in_checksum={}\n".format(seg.addr, seg.file_offs, seg.include_in_checksum))
         fsegname="{}.seg{}".format(filename,idx)
         with open(fsegname, "wb+") as file:
@@ -395,24 +443,16 @@ def flash_image_info(chip, data, filename):
         f_map.write("{} {} 0x{:08x} 0x{:08x} {}\n".format(idx, fsegname, seg.addr, seg.file_offs, seg.include_in_checksum))
 
             
-    calc_checksum = image.calculate_checksum()
+    calc_checksum = parsed.calc_checksum
     log(f_info, 'Checksum: %02x (%s)' % (image.checksum, 'valid' if image.checksum == calc_checksum else 'invalid - calculated %02x' % calc_checksum))
-    if chip == 'esp8266':
-        pass # todo: check elf_sha256 if present
-    else:
-        try:
-            digest_msg = 'Not appended'
-            if image.append_digest:
-                is_valid = image.stored_digest == image.calc_digest
-                digest_msg = "%s (%s)" % (hexify(image.calc_digest).lower(),
-                                        "valid" if is_valid else "invalid")
-                printlog('Validation Hash: %s' % digest_msg)
-        except AttributeError:
-            pass  # ESP8266 image has no append_digest field
+    if parsed.digest_valid is not None:
+        digest_msg = "%s (%s)" % (hexify(image.calc_digest).lower(),
+                                "valid" if parsed.digest_valid else "invalid")
+        printlog('Validation Hash: %s' % digest_msg)
 
     f_map.close()
     f_info.close()
-    return True
+    return parsed
 
 
 def flash_progress(progress, length, message=""):
@@ -432,7 +472,221 @@ def read_flash(esp, flash_address, flash_size, flash_progress=flash_progress):
     printlog('\rRead %d bytes at 0x%x in %.1f seconds (%.1f kbit/s)...' % (len(data), flash_address, t, len(data) / t * 8 / 1000))
     return data
 
+def flash_blocks(start, end, block_size):
+    return [ (addr, min(block_size, end-addr)) for addr in range(start, end, block_size) ]
+
+def read_flash_changed(esp, flash, blocks, expected):
+    """ Fill flash (bytearray) at blocks [(addr, size)]: if on-device MD5 of a block matches
+        expected(addr, size) data it is taken, the rest is read from device.
+        Returns [start, end] ranges which were read, adjacent blocks are joined.
+    """
+    t = time.time()
+    ranges = []
+    for addr, size in blocks:
+        data = expected(addr, size)
+        if data is not None and len(data) == size and esp.flash_md5sum(addr, size) == hashlib.md5(data).hexdigest():
+            flash[addr:addr+size] = data
+            continue
+        if ranges and ranges[-1][1] == addr:
+            ranges[-1][1] = addr + size
+        else:
+            ranges.append([addr, addr+size])
+    t = time.time() - t
+    printlog("Compared %d blocks by MD5 in %.1f seconds: %d bytes to read in %d ranges" % (len(blocks), t, sum(end-start for start,end in ranges), len(ranges)))
+
+    for start, end in ranges:
+        flash[start:end] = read_flash(esp, start, end-start)
+    return ranges
+
+def read_flash_incremental(esp, flash_size, reference, block_size=FLASH_BLOCK_SIZE):
+    """ Read flash taking blocks which on-device MD5 matches reference dump from the reference """
+    flash = bytearray(flash_size)
+    read_flash_changed(esp, flash, flash_blocks(0, flash_size, block_size), lambda addr, size: reference[addr:addr+size])
+    return flash
 
+def read_flash_sparse(esp, flash_size, partition_table_offsets, block_size=FLASH_BLOCK_SIZE):
+    """ Read bootloader and partitions table, then only not erased blocks of partitions and gaps between them """
+    flash = bytearray(b'\xff') * flash_size
+
+    head_size = (max(partition_table_offsets) + FIRMWARE_PARTITIONS_TABLE_SIZE + 0xfff) & ~0xfff
+    head_size = min(head_size, flash_size)
+    flash[:head_size] = read_flash(esp, 0, head_size)
+
+    table = None
+    for part_offset in partition_table_offsets:
+        if flash[part_offset:part_offset+2] == esp32part.PartitionDefinition.MAGIC_BYTES:
+            table = esp32part.PartitionTable.from_binary(flash[part_offset:part_offset+FIRMWARE_PARTITIONS_TABLE_SIZE])
+            break
+    if table is None:
+        printlog("No partitions table found, reading the rest of flash")
+        flash[head_size:] = read_flash(esp, head_size, flash_size-head_size)
+        return flash
+
+    # blocks don't cross partitions bounds, so erased partition (empty OTA slot) is skipped entirely
+    bounds = set([head_size, flash_size])
+    for p in table:
+        bounds.update( min(max(b, head_size), flash_size) for b in (p.offset, p.offset+p.size) )
+    bounds = sorted(bounds)
+    blocks = []
+    for start, end in zip(bounds, bounds[1:]):
+        blocks += flash_blocks(start, end, block_size)
+
+    ranges = read_flash_changed(esp, flash, blocks, lambda addr, size: b'\xff'*size)
+    for p in table:
+        pread = sum( max(0, min(end, p.offset+p.size) - max(start, p.offset)) for start, end in ranges )
+        printlog("{} read 0x{:08x} bytes".format(p, pread))
+    return flash
+
+def lower_baud(baud):
+    """ Next lower of BAUD_RATES, baud itself if there is no lower one """
+    lower = [ b for b in BAUD_RATES if b < baud ]
+    return lower[0] if lower else baud
+
+def reconnect_device(esp, baud):
+    """ Restart link to device (stub is out of sync after interrupted command): connect
+        at ROM baud rate and switch to baud. Returns new esp
+    """
+    chip_name = re.sub(r"[-()]", "", esp.CHIP_NAME.lower())
+    port = esp._port.port
+    esp._port.close()
+    initial_baud = get_initial_baud(baud)
+    esp = connect_device(chip_name, port, initial_baud)
+    if baud != initial_baud:
+        esp.change_baud(baud)
+    return esp
+
+def read_flash_chunked(esp, flash_size, partial, resume=False, chunk_size=FLASH_CHUNK_SIZE, received=None):
+    """ Read flash by chunks written to partial file as they arrive, done chunks are recorded in
+        partial.json so interrupted read can be resumed. Failed chunk is retried, baud rate is
+        dropped after repeated errors. received(addr, data) is called for every chunk in place.
+        Returns (esp, flash), esp is reconnected after failed chunk
+    """
+    fprogress = partial + ".json"
+    progress = { "flash_size": flash_size, "chunk_size": chunk_size, "chunks": {} }
+    if resume and os.path.exists(partial) and os.path.exists(fprogress):
+        with open(fprogress, "rt") as f:
+            saved = json.load(f)
+        if saved["flash_size"] == flash_size and saved["chunk_size"] == chunk_size:
+            # device could be reflashed meanwhile, keep only chunks which on-device MD5 still matches
+            for addr, md5 in saved["chunks"].items():
+                if esp.flash_md5sum(int(addr, 16), min(chunk_size, flash_size - int(addr, 16))) == md5:
+                    progress["chunks"][addr] = md5
+            printlog("Resuming read from {}: {} of {} chunks done".format(partial, len(progress["chunks"]), len(saved["chunks"])))
+        else:
+            printlog("Partial read {} doesn't match flash, starting from scratch".format(partial))
+            resume = False
+    else:
+        resume = False
+
+    t = time.time()
+    nread = 0
+    errors = 0
+    with open(partial, "r+b" if resume else "w+b") as f:
+        f.truncate(flash_size)
+        for addr, size in flash_blocks(0, flash_size, chunk_size):
+            if hex(addr) in progress["chunks"]:
+                if received:
+                    f.seek(addr)
+                    received(addr, f.read(size))
+                continue
+            for attempt in range(FLASH_CHUNK_RETRIES):
+                try:
+                    data = esp.read_flash(addr, size, lambda p, l, offset: flash_progress(addr+p, flash_size))
+                    errors = 0
+                    break
+                except (esptool.FatalError, OSError) as err:
+                    printlog("\nRead of chunk 0x{:x} failed ({}/{}): {}".format(addr, attempt+1, FLASH_CHUNK_RETRIES, err))
+                    errors += 1
+                    baud = esp._port.baudrate
+                    if errors % FLASH_CHUNK_ERRORS_BAUD_DROP == 0 and lower_baud(baud) != baud:
+                        printlog("Dropping baud rate {} -> {}".format(baud, lower_baud(baud)))
+                        baud = lower_baud(baud)
+                    # stub is still inside interrupted read, so link is restarted as in negotiate_baud
+                    try:
+                        esp = reconnect_device(esp, baud)
+                    except (esptool.FatalError, OSError) as err:
+                        printlog("Failed to reconnect: {}".format(err))
+            else:
+                raise FatalError("Failed to read flash at 0x{:x}, already read chunks are kept in {}, use --resume to continue".format(addr, partial))
+            f.seek(addr)
+            f.write(data)
+            f.flush()
+            nread += size
+            progress["chunks"][hex(addr)] = hashlib.md5(data).hexdigest()
+            # progress record is replaced atomically, only after chunk data is written
+            with open(fprogress + ".tmp", "wt") as fp:
+                json.dump(progress, fp)
+            os.replace(fprogress + ".tmp", fprogress)
+            if received:
+                received(addr, data)
+        f.seek(0)
+        flash = f.read()
+    t = time.time() - t
+    printlog('\rRead %d bytes in %.1f seconds (%.1f kbit/s)...' % (nread, t, nread / t * 8 / 1000))
+
+    os.remove(partial)
+    os.remove(fprogress)
+    return esp, flash
+
+class FlashStream(object):
+    """ Flash image being read from device by another thread. Analysis waits for byte
+        ranges it needs, so it runs while the rest of flash is still being read.
+    """
+    chip = None
+    data = None
+    error = None
+    done = False
+
+    def __init__(self, chunk_size=FLASH_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.chunks = set()
+        self.cond = threading.Condition()
+
+    def run(self, read, *args):
+        """ Reader thread: read(*args, stream=self) """
+        try:
+            read(*args, stream=self)
+        except BaseException as err:
+            self.error = err
+        finally:
+            with self.cond:
+                self.done = True
+                self.cond.notify_all()
+
+    def start(self, chip, flash_size):
+        with self.cond:
+            self.chip = chip
+            self.data = bytearray(flash_size)
+            self.cond.notify_all()
+
+    def received(self, addr, data):
+        with self.cond:
+            self.data[addr:addr+len(data)] = data
+            self.chunks.update(range(addr, addr+len(data), self.chunk_size))
+            self.cond.notify_all()
+
+    def check(self):
+        if self.error is not None:
+            raise FatalError("Failed to read firmware: {}".format(self.error))
+
+    def wait_start(self):
+        """ Wait for flash size to be known, returns (chip, flash memoryview) """
+        with self.cond:
+            self.cond.wait_for(lambda: self.data is not None or self.done)
+        self.check()
+        if self.data is None:
+            raise FatalError("Failed to read firmware")
+        return self.chip, memoryview(self.data)
+
+    def wait(self, start, end):
+        """ Wait for [start, end) range of flash to be read """
+        start -= start % self.chunk_size
+        needed = range(start, min(end, len(self.data)), self.chunk_size)
+        with self.cond:
+            self.cond.wait_for(lambda: self.chunks.issuperset(needed) or self.done)
+        if not self.chunks.issuperset(needed):
+            self.check()
+            raise FatalError("Flash range 0x{:x}-0x{:x} was not read".format(start, end))
 
 class ESPEFUSEARGS:
     format = ""
@@ -444,39 +698,51 @@ class ESPEFUSEARGS:
 
 
 
-def read_firmware_from_device(chip, port, baud, read_efuses=True):
-    global FIRMWARE_CHIP, FIRMWARE_ESP
-
-    initial_baud = min(esptool.ESPLoader.ESP_ROM_BAUD, baud)  # don't sync faster than the default baud rate
-
-    ports = [port]
-    if port == 'auto':
-        ports = sorted(ports.device for ports in list_ports.comports())
-    printlog("Try detect board at ports: {}".format(ports))
-
-    chip_def = None
-    efuse_class = None
-    chip_class = None
-    for p in ports:
-        printlog("Try serial port %s" % p)
-        try:
-            esp =  espefuse.get_esp(chip=chip, port=p, baud=initial_baud, before='default_reset', skip_connect=False)
-            esp = esp.run_stub()
-            esptool.attach_flash(esp)
+def get_initial_baud(baud):
+    if baud == 'auto':
+        return esptool.ESPLoader.ESP_ROM_BAUD
+    return min(esptool.ESPLoader.ESP_ROM_BAUD, baud)  # don't sync faster than the default baud rate
+
+def connect_device(chip, port, initial_baud):
+    esp =  espefuse.get_esp(chip=chip, port=port, baud=initial_baud, before='default_reset', skip_connect=False)
+    esp = esp.run_stub()
+    esptool.attach_flash(esp)
+    return esp
+
+def negotiate_baud(esp, initial_baud, rates=BAUD_RATES):
+    """ Try rates from the fastest one reading test block, stops at the first one which
+        returns data matching on-device MD5. Link is lost after failed rate so device is
+        reconnected. Returns (esp, baud)
+    """
+    chip_name = re.sub(r"[-()]", "", esp.CHIP_NAME.lower())
+    port = esp._port.port
+    size = FLASH_BLOCK_SIZE
+    md5 = esp.flash_md5sum(0, size)
+    for baud in rates:
+        if baud <= initial_baud:
             break
-        #except (FatalError, OSError) as err:
-            #printlog("%s failed to connect: %s" % (p, err))
-        except Exception as inst:
-            #printlog(type(inst))
-            #printlog(inst.args)
-            printlog(inst)
-            esp = None
-
-    if esp is None:
-        raise FatalError("Could not connect to an Espressif device at %s serial port." % ports)
-
-    # FIRMWARE_CHIP = esp.CHIP_NAME
-    FIRMWARE_CHIP = re.sub(r"[-()]", "", esp.CHIP_NAME.lower()) 
+        try:
+            esp.change_baud(baud)
+            t = time.time()
+            data = esp.read_flash(0, size)
+            t = time.time() - t
+            if hashlib.md5(data).hexdigest() == md5:
+                printlog("Baud rate {}: {:.1f} kbit/s".format(baud, size / t * 8 / 1000))
+                return esp, baud
+            printlog("Baud rate {}: data mismatch".format(baud))
+        except (esptool.FatalError, OSError) as err:
+            printlog("Baud rate {}: {}".format(baud, err))
+        esp._port.close()
+        esp = connect_device(chip_name, port, initial_baud)
+    printlog("Keeping initial baud rate {}".format(initial_baud))
+    return esp, initial_baud
+
+def read_device(esp, baud, initial_baud, read_efuses=True, efuses_filename=None, reference=None, sparse=False, partition_table_offsets=FIRMWARE_PARTITIONS_TABLE_OFFSETS, resume=False, stream=None):
+    """ Read EFUSEs (to efuses_filename.*) and full flash image of connected device.
+        Full read is handed to stream (FlashStream) chunk by chunk, other modes at once.
+        Returns (esp, flash), esp may be reconnected while negotiating baud rate or after failed chunk
+    """
+    chip_name = re.sub(r"[-()]", "", esp.CHIP_NAME.lower()) 
 
     printlog("Chip is %s" % (esp.get_chip_description()))
     printlog("Features: %s" % ", ".join(esp.get_chip_features()))
@@ -487,7 +753,9 @@ def read_firmware_from_device(chip, port, baud, read_efuses=True):
 
        
 
-    if baud > initial_baud:
+    if baud == 'auto':
+        esp, baud = negotiate_baud(esp, initial_baud)
+    elif baud > initial_baud:
         try:
             esp.change_baud(baud)
         except NotImplementedInROMError:
@@ -498,13 +766,13 @@ def read_firmware_from_device(chip, port, baud, read_efuses=True):
     printlog('Auto-detected Flash size:', flash_size)
 
     if read_efuses:
-        if FIRMWARE_CHIP == 'esp8266':
+        if chip_name == 'esp8266':
             efuses = esp.get_efuses()
-            with open(FILE_EFUSES_TXT+".txt","wt") as f:
+            with open(efuses_filename+".txt","wt") as f:
                 f.write(bin(efuses))
         else:
             with espefuse.init_commands(esp=esp) as efuses_cmd:
-                with open(FILE_EFUSES_TXT+".cvs", "wt") as f:
+                with open(efuses_filename+".cvs", "wt") as f:
                     log(f, "EFUSES:")
                     for b in efuses_cmd.efuses.blocks:
                         log(f, "\nName={}\nid={} Alias={} Read_addr=0x{:04x} Write_addr=0x{:04x} len={} read_disable_bit={} write_disable_bit={} key_purpose_name={}".format(
@@ -515,17 +783,104 @@ def read_firmware_from_device(chip, port, baud, read_efuses=True):
 
                 # s = efuses.efuses.summary()
                 # if s:
-                with open(FILE_EFUSES_TXT+".txt", "wt") as f:
+                with open(efuses_filename+".txt", "wt") as f:
                     efuses_cmd.summary(format="summary", file=f)
-                with open(FILE_EFUSES_TXT+".json", "wt") as f:
+                with open(efuses_filename+".json", "wt") as f:
                     efuses_cmd.summary(format="json", file=f)
 
 
-    flash = read_flash(esp, 0, flash_size)
+    if reference:
+        printlog("Reading changes against reference dump: {}".format(reference))
+        with MappedFile(reference) as fref:
+            flash = read_flash_incremental(esp, flash_size, fref.view)
+    elif sparse:
+        printlog("Reading used flash regions only")
+        flash = read_flash_sparse(esp, flash_size, partition_table_offsets)
+    else:
+        partial = espconsts.FILE_PARTIAL.format("".join("%02x" % x for x in mac))
+        if stream:
+            stream.start(chip_name, flash_size)
+        esp, flash = read_flash_chunked(esp, flash_size, partial, resume, received=stream.received if stream else None)
+    if stream and stream.data is None:
+        stream.start(chip_name, flash_size)
+        stream.received(0, flash)
+    return esp, flash
+
+def read_firmware_from_device(chip, port, baud, read_efuses=True, reference=None, sparse=False, partition_table_offsets=FIRMWARE_PARTITIONS_TABLE_OFFSETS, resume=False, stream=None):
+    global FIRMWARE_ESP
+
+    initial_baud = get_initial_baud(baud)
+
+    ports = [port]
+    if port == 'auto':
+        ports = sorted(ports.device for ports in list_ports.comports())
+    printlog("Try detect board at ports: {}".format(ports))
+
+    esp = None
+    for p in ports:
+        printlog("Try serial port %s" % p)
+        try:
+            esp = connect_device(chip, p, initial_baud)
+            break
+        #except (FatalError, OSError) as err:
+            #printlog("%s failed to connect: %s" % (p, err))
+        except Exception as inst:
+            #printlog(type(inst))
+            #printlog(inst.args)
+            printlog(inst)
+            esp = None
+
+    if esp is None:
+        raise FatalError("Could not connect to an Espressif device at %s serial port." % ports)
+
+    esp, flash = read_device(esp, baud, initial_baud, read_efuses, espconsts.FILE_EFUSES_TXT, reference, sparse, partition_table_offsets, resume, stream)
         
     FIRMWARE_ESP = esp
     return flash
 
+def _read_device_at_port(chip, port, baud, read_efuses, sparse, partition_table_offsets, resume):
+    """ Thread worker: read device at port to <output>/<mac>/firmware.bin, returns None if no device there """
+    initial_baud = get_initial_baud(baud)
+    try:
+        esp = connect_device(chip, port, initial_baud)
+    except Exception as inst:
+        printlog("{}: {}".format(port, inst))
+        return None
+
+    mac = "".join("%02x" % x for x in esp.read_mac())
+    basedir = os.path.join(espconsts.BASEDIR_DIS, mac)
+    os.makedirs(basedir, exist_ok=True)
+    printlog("{}: device {} => {}".format(port, mac, basedir))
+    esp, flash = read_device(esp, baud, initial_baud, read_efuses, "{}/efuses".format(basedir), None, sparse, partition_table_offsets, resume)
+
+    fname = os.path.join(basedir, os.path.basename(espconsts.FILE_FIRMWARE))
+    printlog("Writing full firmware to: {}".format(fname))
+    with open(fname, "wb") as f:
+        f.write(flash)
+    chip_name = re.sub(r"[-()]", "", esp.CHIP_NAME.lower())
+    return chip_name, fname, basedir
+
+def read_firmware_from_all_devices(chip, baud, read_efuses=True, sparse=False, partition_table_offsets=FIRMWARE_PARTITIONS_TABLE_OFFSETS, resume=False):
+    """ Read all devices connected to serial ports at once, one thread per port.
+        Returns [(chip, firmware file, output directory)]
+    """
+    ports = sorted(p.device for p in list_ports.comports())
+    printlog("Reading all devices at ports: {}".format(ports))
+    if not ports:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        futures = [ pool.submit(_read_device_at_port, chip, p, baud, read_efuses, sparse, partition_table_offsets, resume) for p in ports ]
+        devices = []
+        for p, future in zip(ports, futures):
+            try:
+                device = future.result()
+            except Exception as inst:
+                printlog("{}: failed to read device: {}".format(p, inst))
+                continue
+            if device:
+                devices.append(device)
+    return devices
+
 # section header flags
 # Key to Flags:
 #   W (write), A (alloc), X (execute), M (merge), S (strings), I (info),
@@ -569,37 +924,89 @@ def calcShFlg(flags):
     return mask
 
 
-def add_elf_symbols(elf,filename):
-    #pass
-    fh = open(filename, "rt")
-    if not fh: 
-        return
-
-    elf.append_special_section('.symtab')
-
-    lines = fh.readlines()
+class SectionIndex(object):
+    """ Sorted disjoint address intervals of PROGBITS sections for bisect lookup,
+        where sections overlap the address belongs to the first one (as in linear search)
+    """
+    def __init__(self, sections):
+        ranges = [ (sec.addr, sec.addr+sec.size, sindex) for sindex, sec in enumerate(sections)
+                   if sec.sh_type == SHT.SHT_PROGBITS and sec.size ]
+        bounds = sorted(set( b for r in ranges for b in r[:2] ))
+        self.starts = []
+        self.intervals = []
+        for start, end in zip(bounds, bounds[1:]):
+            sindex = min( (r[2] for r in ranges if r[0] <= start and end <= r[1]), default=None )
+            if sindex is None:
+                continue
+            if self.intervals and self.intervals[-1][1] == start and self.intervals[-1][2] == sindex:
+                self.intervals[-1] = (self.intervals[-1][0], end, sindex) # merge with previous
+                continue
+            self.starts.append(start)
+            self.intervals.append((start, end, sindex))
+
+    def find(self, addr, default=None):
+        """ Index of section containing addr """
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i >= 0 and addr < self.intervals[i][1]:
+            return self.intervals[i][2]
+        return default
+
+
+# board segment files mapped by this process: file name -> MappedFile
+board_segment_files = {}
+# (segment, DRAM0 data start) -> memoryview of segment data used in ELF
+board_segment_views = {}
+
+def map_board_segment_file(sfile):
+    mapped = board_segment_files.get(sfile, None)
+    if mapped is None:
+        mapped = MappedFile(sfile)
+        board_segment_files[sfile] = mapped
+    return mapped
+
+def board_segment_view(segment, dram0_data_start=None):
+    """ Read-only view of board segment (name, address, size, file) data, mapped once per process.
+        Segment overlapping DRAM0 data of image is cut before it. None if file is bad.
+    """
+    key = (segment, dram0_data_start)
+    view = board_segment_views.get(key, None)
+    if view is not None:
+        return view
+
+    sname, saddr, slen, sfile = segment
+    saddr = int(saddr, base=16)
+    slen = int(slen, base=16)
+    mapped = map_board_segment_file(sfile)
+    if not len(mapped):
+        printlog("Failed to read: " + sfile)
+        return None
+    if len(mapped)!=slen:
+        printlog("File size and size in config mismath: 0x{:x} != 0x{:8} ".format(len(mapped), slen))
+        return None
+
+    if dram0_data_start!=None and dram0_data_start>=saddr and dram0_data_start <saddr+slen:
+        slen = (dram0_data_start - saddr) & ~0xffff #paragraph align? Or page?
+    view = mapped.view[:slen]
+    board_segment_views[key] = view
+    return view
+
+
+def add_elf_symbols(elf, filename, sections=None):
+    """ Add symbols from readelf -s like listing (compiled SymbolDB of it), sections - SectionIndex of elf (built if None) """
+    elf.add_symtab()
+
+    if sections is None:
+        sections = SectionIndex(elf.sections)
 
     bind_map = {"LOCAL" : STB.STB_LOCAL, "GLOBAL" : STB.STB_GLOBAL}
     type_map = {"NOTYPE": STT.STT_NOTYPE, "OBJECT" : STT.STT_OBJECT, "FUNC" : STT.STT_FUNC, "FILE" : STT.STT_FILE}
 
-    for line in lines:
-        line = line.split()
-        sym_binding = line[4]
-        sym_type = line[3]
-        sym_size = int(line[2])
-        sym_val = int(line[1], 16)
-        sym_name = line[7]
-                                  
+    for sym_name, sym_val, sym_size, sym_type, sym_binding in esp32symdb.load_symbols(filename):
         sym_section = SHN.SHN_ABS
         #try locate section by addresses
         if sym_type in ['NOTYPE','OBJECT','FUNC']:
-            for sindex, shdr in enumerate(elf.Elf.Shdr_table):
-                if shdr.sh_type != SHT.SHT_PROGBITS:
-                    continue
-                if sym_val>=shdr.sh_addr and sym_val<shdr.sh_addr+shdr.sh_size:
-                    sym_section=sindex
-                    break
-        elf.append_symbol(sym_name, sym_section, sym_val, sym_size, sym_binding=bind_map[sym_binding], sym_type=type_map[sym_type])
+            sym_section = sections.find(sym_val, SHN.SHN_ABS)
+        elf.add_symbol(sym_name, sym_section, sym_val, sym_size, bind_map[sym_binding], type_map[sym_type])
 
 
 def convert_sec2seg_flg(sec_flags):
@@ -622,14 +1029,12 @@ def calcPhFlg(flags):
         p_flags |= PF.PF_X
     return p_flags
 
-def export_bin2elf(chip, data, filename, board_ext_symbols, board_ext_segments):
-    global DRAM0_DATA_START, DRAM0_DATA_END
-
-    image = esptool.bin_image.LoadFirmwareImage(chip, data)
+def export_bin2elf(ctx, parsed, filename, board_ext_symbols, board_ext_segments):
+    """ Write filename.elf of image (ParsedImage) with board symbols and segments """
+    image = parsed.image
     image_name = filename+".elf"
 
-    elf = ELF(e_machine=EM.EM_XTENSA, e_data=ELFDATA.ELFDATA2LSB)
-    elf.Elf.Ehdr.e_entry = image.entrypoint
+    elf = esp32elf.ElfWriter(EM.EM_XTENSA, image.entrypoint)
 
     # maps segment names to ELF sections
 
@@ -711,15 +1116,15 @@ def export_bin2elf(chip, data, filename, board_ext_symbols, board_ext_segments):
 
     iram_vectors_found = False
 
-    IRAM_SEG = memory_segment(image, "IRAM")
+    IRAM_SEG = parsed.iram
     
     elf_sections = []
 
     #segment sorted by addresses i.e. if some segment was split we can easily join it back
-    for seg in sorted(image.segments, key=lambda s:s.addr):
+    for seg, regions in sorted(zip(image.segments, parsed.regions), key=lambda s:s[0].addr):
 
         # get memroy segments at specified address
-        mem_segments = get_memory_segments(image, seg.addr)
+        mem_segments = set(regions)
 
         if not mem_segments:
             printlog("Unknown segment at 0x{:08x}!!!!".format(seg.addr))
@@ -756,32 +1161,22 @@ def export_bin2elf(chip, data, filename, board_ext_symbols, board_ext_segments):
             return
         printlog("Segment at addr=0x{:08x} => {} => {}".format(seg.addr, mem_segments, elf_segment))
 
+        # section data is list of segments data, written to file one by one
         fjoin = len(elf_sections)>0 and elf_sections[-1][-1] == elf_segment and elf_sections[-1][0]+elf_sections[-1][1]==seg.addr
         if fjoin:
             printlog("Join segments 0x{:08x} and 0x{:08x}".format(elf_sections[-1][0], seg.addr))
             elf_sections[-1][1]+=len(seg.data)
-            elf_sections[-1][2]+=seg.data
+            elf_sections[-1][2].append(seg.data)
         else: 
-            elf_sections.append( [seg.addr, len(seg.data), copy.copy(seg.data), elf_segment] )
+            elf_sections.append( [seg.addr, len(seg.data), [seg.data], elf_segment] )
 
 
     if board_ext_segments:
-        for sname, saddr, slen, sfile in board_ext_segments:
-            saddr = int(saddr, base=16)
-            slen = int(slen, base=16)
-            sdata = None
-            with open(sfile,"rb") as fdata:
-                sdata=fdata.read()
-            if not sdata:
-                printlog("Failed to read: " + sfile)
-                return None
-            if len(sdata)!=slen:
-                printlog("File size and size in config mismath: 0x{:x} != 0x{:8} ".format(len(sdata), slen))
+        for segment in board_ext_segments:
+            sdata = board_segment_view(segment, ctx.dram0_data_start)
+            if sdata is None:
                 return None
-
-            if DRAM0_DATA_START!=None and DRAM0_DATA_START>=saddr and DRAM0_DATA_START <saddr+slen:
-                slen = (DRAM0_DATA_START - saddr) & ~0xffff #paragraph align? Or page?
-            elf_sections.append( [saddr, slen, sdata[:slen], sname] )
+            elf_sections.append( [int(segment[1], base=16), len(sdata), [sdata], segment[0]] )
 
 
     for sec_addr, sec_len, sec_data, sec_name in elf_sections:
@@ -797,22 +1192,19 @@ def export_bin2elf(chip, data, filename, board_ext_symbols, board_ext_segments):
         # Lk    : sh_link
         # Inf   : sh_info
         # Al    : sh_addralign        
-        elf._append_section(sec_name, sec_data, sec_addr, SHT.SHT_PROGBITS, flg, sh_link, sh_info, sh_addralign, sh_entsize )
+        elf.add_section(sec_name, sec_data, sec_addr, SHT.SHT_PROGBITS, flg, sh_link, sh_info, sh_addralign, sh_entsize )
 
 
-    elf.append_special_section('.strtab')
+    elf.add_strtab()
 
 
     if board_ext_symbols:
+        # symbols don't add PROGBITS sections, so index is built once for all files
+        sections = SectionIndex(elf.sections)
         for fname in board_ext_symbols:
-            add_elf_symbols(elf, fname)
+            add_elf_symbols(elf, fname, sections)
 
 
-    # there is an initial program header that we don't want...
-    elf.Elf.Phdr_table.pop()
-
-    bytes(elf) # kind of a hack, but __bytes__() calculates offsets in elf object
-
     printlog("\nAdding program headers")
     #  Section to Segment mapping:
     #   Segment Sections... application
@@ -843,47 +1235,325 @@ def export_bin2elf(chip, data, filename, board_ext_symbols, board_ext_segments):
     for i,p in enumerate(pg_segments):
         printlog("prg_seg {} : {:08x} {:08x} {} {}".format( i, p[0], p[1], p[2], p[3]))
 
-    size_of_phdrs = len(Elf32_Phdr()) * len(pg_segments) # to pre-calculate program header offsets
+    for pg_addr, pg_size, pg_flags, pg_first_section in pg_segments:
+        elf.add_segment(elf.section_by_name(pg_first_section), pg_addr, pg_size, calcPhFlg(pg_flags), 0x1000)
 
+    # offsets are known once all headers are added
+    elf.layout()
 
     printlog("Program Headers:")
     printlog("Type  Offset    VirtAddr  PhysAddr  FileSize  MemSize  Flg Align")
 
-    for pg_addr, pg_size, pg_flags, pg_first_section in pg_segments:
-        p_flags = calcPhFlg(pg_flags)
-
-        align = 0x1000
-        p_type = PT.PT_LOAD
-
-        shstrtab_hdr, shstrtab = elf.get_section_by_name(pg_first_section)
-        offset = shstrtab_hdr.sh_offset + size_of_phdrs # account for new offset
-
-        # build program header
-        Phdr = Elf32_Phdr(PT.PT_LOAD, p_offset=offset, p_vaddr=pg_addr,
-                p_paddr=pg_addr, p_filesz=pg_size, p_memsz=pg_size,
-                p_flags=p_flags, p_align=align, little=elf.little)
-
-        #printlog(pg_first_section + ": " + str(Phdr))
-        printlog("{:2}    {:08x}  {:08x}  {:08x}  {:08x}  {:08x}  {}  {:04x}".format( Phdr.p_type, Phdr.p_offset, Phdr.p_vaddr, Phdr.p_paddr, Phdr.p_filesz, Phdr.p_memsz, Phdr.p_flags, Phdr.p_align))
-        elf.Elf.Phdr_table.append(Phdr)
+    for p_type, p_section, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, p_align in elf.segments:
+        printlog("{:2}    {:08x}  {:08x}  {:08x}  {:08x}  {:08x}  {}  {:04x}".format( p_type, elf.sections[p_section].offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, p_align))
 
     # write out elf file
     printlog("\nWriting ELF to " + image_name + "...")
-    with open(image_name, "wb") as fd:
-        fd.write(bytes(elf))
-
-def main():
-    global FIRMWARE_CHIP, FIRMWARE_ESP
+    elf.write(image_name)
+
+def _analyze_app_partition(ctx, data, filename, board_ext_symbols, board_ext_segments, parsed=None):
+    parsed=flash_image_info( ctx, data, filename, parsed )
+    if parsed:
+        export_bin2elf( ctx, parsed, filename, board_ext_symbols, board_ext_segments )
+    return parsed is not None
+
+def analyze_app_partition(ctx, data, filename, board_ext_symbols, board_ext_segments, cache=None, parsed=None):
+    """ Info, map, segments and ELF of image, parsed - ParsedImage of data if it is already parsed """
+    if cache is None:
+        return _analyze_app_partition(ctx, data, filename, board_ext_symbols, board_ext_segments, parsed)
+
+    key = cache.key(ctx, data, board_ext_symbols, board_ext_segments)
+    entry = cache.load(key, filename)
+    if entry is not None:
+        printlog("Restored from cache: {}".format(key))
+        ctx.dram0_data_start = entry["dram0_data_start"]
+        ctx.dram0_data_end = entry["dram0_data_end"]
+    else:
+        try:
+            with log_capture() as output:
+                fparsed = _analyze_app_partition(ctx, data, filename, board_ext_symbols, board_ext_segments, parsed)
+        except Exception:
+            printlog(output.getvalue(), end="")
+            raise
+        entry = { "fparsed": fparsed, "dram0_data_start": ctx.dram0_data_start, "dram0_data_end": ctx.dram0_data_end, "log": output.getvalue() }
+        suffixes = [ f[len(filename):] for f in glob.glob(glob.escape(filename)+".*") ]
+        suffixes = [ s for s in suffixes if s in (".info", ".map", ".elf") or re.match(r"\.seg\d+$", s) ]
+        cache.store(key, filename, sorted(suffixes), entry)
+    printlog(entry["log"], end="")
+    return entry["fparsed"]
+
+def _pool_init():
+    # log file belongs to parent process, worker output is captured and merged by parent
+    log_detach()
+
+def _pool_analyze_app_partition(ctx, filename, board_ext_symbols, board_ext_segments, cache):
+    with MappedFile(filename) as part, log_capture() as output:
+        fparsed = analyze_app_partition(ctx, part.view, filename, board_ext_symbols, board_ext_segments, cache)
+    return output.getvalue(), fparsed
+
+def get_chip_class(chip):
+    chip_class = None
+    chip_def = espefuse.efuse_interface.SUPPORTED_CHIPS.get(chip, None)
+    if chip == 'esp8266':
+        chip_class = esptool.targets.ESP8266ROM
+    elif chip_def:
+        chip_class = chip_def.chip_class  # for get_chip_description, get_chip_features, get_crystal_freq
+
+    if not chip_class:
+        printlog("Unsupported chip: {}".format(chip))
+    return chip_class
+
+def load_board_config(board):
+    """ Returns (symbols files, segments) from boards/<board>/config.txt or None if board not found """
+    board_ext_symbols = []
+    board_ext_segments = []
+    pathboard = os.path.join("boards",board)
+    printlog("Try load additional board info from: {}".format(pathboard))
+    if not os.path.exists(pathboard):
+        printlog("Path not exists: " + pathboard)
+        return None
+    pathconfig = os.path.join(pathboard, "config.txt")
+    printlog("Loading board config from: ")
+    if not os.path.exists(pathconfig):
+        printlog("Path not exists: " + pathconfig)
+        return None
+    with open(pathconfig, "rt") as fc:
+        for line in fc:
+            ctype, cvalue = line.split(":")
+            ctype=ctype.strip()
+            cvalue=cvalue.strip()
+            if ctype=="symbols":
+                csymbols = [ os.path.join(pathboard, c) for c in cvalue.split() ]
+                # compiled once here, workers just map them
+                for c in csymbols:
+                    esp32symdb.load_symbols(c)
+                board_ext_symbols+=csymbols
+            if ctype=="segment":
+                csegment = list(cvalue.split())
+                csegment[-1]=os.path.join(pathboard, csegment[-1])
+                board_ext_segments.append(tuple(csegment))
+                # mapped once here, workers share the mapping
+                try:
+                    map_board_segment_file(csegment[-1])
+                except OSError:
+                    pass # reported when segment is used
+    return board_ext_symbols, board_ext_segments
+
+def analyze_firmware(chip, flash, board_ext_symbols, board_ext_segments, partition_table_offsets, jobs=1, cache=None, wait=None):
+    """ Dissect full flash image to output directory, returns partitions table (None for ESP8266).
+        If flash is still being read wait(start, end) is called before each range is used.
+    """
+    streaming = wait is not None
+    if wait is None:
+        wait = lambda start, end: None
 
-    #### globally accessed bins and pased data
-    FIRMWARE_FULL_BIN = None
     FIRMWARE_PARTITIONS_BIN = None
     FIRMWARE_PARTITIONS_TABLE = None
     FIRMWARE_PARTITIONS_FNAMES = []
- 
+
     BOOTLOADER_IMAGE     = None #parsed
     BOOTLOADER_IMAGE_BIN = None #binary
 
+    chip_class = get_chip_class(chip)
+    if not chip_class:
+        return None
+
+    ctx = AnalysisContext(chip)
+
+    # Handle ESP8266 specially
+    if chip == 'esp8266':
+        wait(0, len(flash))
+        esp8266_analyze_firmware(ctx, flash, board_ext_symbols, board_ext_segments)
+        return None
+
+    # bootloader ends before partitions table, no need to hand the whole flash to the parser
+    bootloader_offset = chip_class.BOOTLOADER_FLASH_OFFSET
+    wait(0, max(partition_table_offsets)+FIRMWARE_PARTITIONS_TABLE_SIZE)
+    fbootloader = flash[bootloader_offset:max(partition_table_offsets)]
+    BOOTLOADER_IMAGE = ParsedImage(chip, fbootloader)
+    image_size = BOOTLOADER_IMAGE.size
+    BOOTLOADER_IMAGE_BIN = flash[bootloader_offset:bootloader_offset+image_size]
+    printlog("Writing bootloader to: {}".format(espconsts.FILE_BOOTLOADER))
+    with open(espconsts.FILE_BOOTLOADER,"wb") as f:
+        f.write(BOOTLOADER_IMAGE_BIN)
+    printlog("Bootloader image info:")
+    printlog("=================================================================================")
+    analyze_app_partition(ctx, BOOTLOADER_IMAGE_BIN, espconsts.FILE_BOOTLOADER, None, None, cache, BOOTLOADER_IMAGE)
+    printlog("=================================================================================\n")
+
+
+    FIRMWARE_PARTITIONS_TABLE_OFFSET = None
+    for part_offset in partition_table_offsets:
+        if flash[part_offset:part_offset+2] != esp32part.PartitionDefinition.MAGIC_BYTES:
+            printlog("No partition table found at: {:x}".format(part_offset))
+            continue
+        printlog("Partition table found at: {:x}".format(part_offset))
+        FIRMWARE_PARTITIONS_TABLE_OFFSET = part_offset
+        break
+    if FIRMWARE_PARTITIONS_TABLE_OFFSET==None:
+        raise FatalError("Failed to find partitions table")
+
+    FIRMWARE_PARTITIONS_BIN = flash[FIRMWARE_PARTITIONS_TABLE_OFFSET:FIRMWARE_PARTITIONS_TABLE_OFFSET+FIRMWARE_PARTITIONS_TABLE_SIZE]
+    FIRMWARE_PARTITIONS_TABLE = esp32part.PartitionTable.from_binary(FIRMWARE_PARTITIONS_BIN)
+    printlog("Verifying partitions table...")
+    FIRMWARE_PARTITIONS_TABLE.verify()
+    output = FIRMWARE_PARTITIONS_TABLE.to_csv()
+
+    printlog("Writing partitions table to: {}".format(espconsts.FILE_PARTITIONS_CSV))
+    with open(espconsts.FILE_PARTITIONS_CSV, 'wt') as f:
+        f.write(output)
+
+    printlog("Writing partitions table to: {}".format(espconsts.FILE_PARTITIONS_BIN))
+    with open(espconsts.FILE_PARTITIONS_BIN, 'wb') as f:
+        f.write(FIRMWARE_PARTITIONS_BIN)
+
+    # app partitions are analyzed in worker processes if requested, each with
+    # own copy of context seeded by bootloader, results are merged in table order
+    pool = None
+    app_jobs = {}
+    app_outputs = {}
+    if jobs > 1:
+        # forking while flash reader thread runs is unsafe, workers are started fresh then
+        mp_context = multiprocessing.get_context("spawn") if streaming else None
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_pool_init, mp_context=mp_context)
+
+    try:
+        FIRMWARE_PARTITIONS_FNAMES = []
+        printlog("PARTITIONS:")
+        for i,p in enumerate(FIRMWARE_PARTITIONS_TABLE):
+            fname = "{}.{}.{}".format(espconsts.FILE_PARTITIONS, i, p.name)
+            printlog("{:4} {} {}".format(i,p,fname))
+            FIRMWARE_PARTITIONS_FNAMES.append(fname)
+            wait(p.offset, p.offset+p.size)
+            part_bin = flash[ p.offset: p.offset+p.size]
+            with open(fname, "wb") as f:
+                f.write( part_bin )
+            if pool and p.type == esp32part.APP_TYPE:
+                log_flush() # workers may be forked here, don't let them inherit pending output
+                app_jobs[i] = pool.submit(_pool_analyze_app_partition, copy.copy(ctx), fname, board_ext_symbols, board_ext_segments, cache)
+            elif streaming and p.type == esp32part.APP_TYPE:
+                # analyze while the rest is being read, output is printed in place below
+                with log_capture() as out:
+                    analyze_app_partition( copy.copy(ctx), part_bin, fname, board_ext_symbols, board_ext_segments, cache )
+                app_outputs[i] = out.getvalue()
+            if p.type == esp32part.DATA_TYPE and p.subtype == esp32part.SUBTYPES[esp32part.DATA_TYPE]['nvs']:
+                parse_nvs_partition(fname, part_bin)
+
+
+        printlog("\nAPP PARTITIONS INFO:")
+        printlog("=================================================================================")
+        for i,p in enumerate(FIRMWARE_PARTITIONS_TABLE):
+            if p.type != esp32part.APP_TYPE:
+                continue
+            printlog("Partition {}".format(p))
+            printlog("-------------------------------------------------------------------")
+            if pool:
+                output, fparsed = app_jobs[i].result()
+                printlog(output, end="")
+                continue
+            if i in app_outputs:
+                printlog(app_outputs[i], end="")
+                continue
+            part_bin = flash[ p.offset: p.offset+p.size]
+            analyze_app_partition( copy.copy(ctx), part_bin, FIRMWARE_PARTITIONS_FNAMES[i], board_ext_symbols, board_ext_segments, cache )
+        printlog("=================================================================================\n")
+    finally:
+        if pool:
+            # on error don't leave queued partitions running behind the exception
+            pool.shutdown(cancel_futures=True)
+
+    return FIRMWARE_PARTITIONS_TABLE
+
+def batch_dumps(inputs):
+    """ Expand directories and glob patterns to the list of dump files """
+    dumps = []
+    for i in inputs:
+        if os.path.isdir(i):
+            files = [ os.path.join(i, f) for f in sorted(os.listdir(i)) ]
+        else:
+            files = sorted(glob.glob(i))
+        for f in files:
+            if os.path.isfile(f) and f not in dumps:
+                dumps.append(f)
+    return dumps
+
+def _batch_analyze_dump(chip, filename, basedir, board_ext_symbols, board_ext_segments, partition_table_offsets, cache):
+    """ Pool worker: dissect one dump to own directory, errors are reported in result """
+    result = { "file": filename, "output": basedir, "chip": chip, "size": os.path.getsize(filename), "status": "failed", "error": None, "partitions": [] }
+
+    espconsts.set_basedir(basedir)
+    os.makedirs(basedir, exist_ok=True)
+    log_open(espconsts.FILE_LOGNAME)
+    # output goes to the dump log only, parent reports progress
+    with open(os.devnull, "wt") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            printlog("Reading firmware from: {}".format(filename))
+            with MappedFile(filename) as firmware:
+                table = analyze_firmware(chip, firmware.view, board_ext_symbols, board_ext_segments, partition_table_offsets, cache=cache)
+            if table:
+                result["partitions"] = [ { "name": p.name, "type": esp32part.type2str(p.type, p.subtype), "offset": p.offset, "size": p.size } for p in table ]
+            result["status"] = "ok"
+        except Exception as inst:
+            result["error"] = "{}: {}".format(type(inst).__name__, inst)
+            printlog(result["error"])
+        finally:
+            log_close()
+    return result
+
+def analyze_batch(chip, inputs, board_ext_symbols, board_ext_segments, partition_table_offsets, jobs=1, cache=None):
+    """ Dissect many dumps in worker processes, each to own subdirectory of output directory """
+    dumps = batch_dumps(inputs)
+
+    # output directory per dump named by file, duplicated names get index suffix
+    basedirs = []
+    for f in dumps:
+        name = os.path.basename(f)
+        basedir = os.path.join(espconsts.BASEDIR_DIS, name)
+        n = 1
+        while basedir in basedirs:
+            basedir = os.path.join(espconsts.BASEDIR_DIS, "{}.{}".format(name, n))
+            n += 1
+        basedirs.append(basedir)
+
+    return analyze_dumps([ (chip, f, d) for f, d in zip(dumps, basedirs) ], board_ext_symbols, board_ext_segments, partition_table_offsets, jobs, cache)
+
+def analyze_dumps(dumps, board_ext_symbols, board_ext_segments, partition_table_offsets, jobs=1, cache=None):
+    """ Dissect [(chip, dump file, output directory)] in worker processes, writes summary index """
+    printlog("Batch: {} dumps, {} workers".format(len(dumps), jobs))
+
+    results = [None] * len(dumps)
+    log_flush()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_pool_init) as pool:
+        # largest dumps first, so the tail of the batch is made of the short ones
+        order = sorted(range(len(dumps)), key=lambda i: os.path.getsize(dumps[i][1]), reverse=True)
+        futures = { pool.submit(_batch_analyze_dump, *dumps[i], board_ext_symbols, board_ext_segments, partition_table_offsets, cache): i for i in order }
+        for done, future in enumerate(concurrent.futures.as_completed(futures)):
+            i = futures[future]
+            chip, fname, basedir = dumps[i]
+            try:
+                results[i] = future.result()
+            except Exception as inst: # worker died
+                results[i] = { "file": fname, "output": basedir, "chip": chip, "size": os.path.getsize(fname), "status": "failed", "error": "{}: {}".format(type(inst).__name__, inst), "partitions": [] }
+            printlog("[{}/{}] {} : {}".format(done+1, len(dumps), fname, results[i]["error"] or results[i]["status"]))
+
+    failed = [ r for r in results if r["status"] != "ok" ]
+    index = { "total": len(results), "ok": len(results)-len(failed), "failed": len(failed), "dumps": results }
+    fname = os.path.join(espconsts.BASEDIR_DIS, espconsts.FILE_BATCH_INDEX)
+    printlog("Writing batch index to: {}".format(fname))
+    with open(fname, "wt") as f:
+        f.write(json.dumps(index, indent=4))
+    printlog("Batch done: {} ok, {} failed".format(index["ok"], index["failed"]))
+    for r in failed:
+        printlog("  {} : {}".format(r["file"], r["error"]))
+    return index
+
+def main():
+    global FIRMWARE_ESP
+
+    #### globally accessed bins and pased data
+    FIRMWARE_IMAGE = None    #mapped input file
+    FIRMWARE_FULL_BIN = None #memoryview, partitions and images are slices of it
+
     BOARD_EXT_SYMBOLS = []
     BOARD_EXT_SEGMENTS = []
 
@@ -891,14 +1561,14 @@ def main():
         printlog("Prepare output directories:")
 
 
-        if os.path.exists(BASEDIR_DIS):
-            printlog("- removing old directory: {}".format(BASEDIR_DIS))
-            shutil.rmtree(BASEDIR_DIS)
+        if os.path.exists(espconsts.BASEDIR_DIS):
+            printlog("- removing old directory: {}".format(espconsts.BASEDIR_DIS))
+            shutil.rmtree(espconsts.BASEDIR_DIS)
 
-        if not os.path.exists(BASEDIR_DIS):
-            printlog("- creating directory: {}".format(BASEDIR_DIS))
-            os.makedirs(BASEDIR_DIS)
-            log_open(FILE_LOGNAME)
+        if not os.path.exists(espconsts.BASEDIR_DIS):
+            printlog("- creating directory: {}".format(espconsts.BASEDIR_DIS))
+            os.makedirs(espconsts.BASEDIR_DIS)
+            log_open(espconsts.FILE_LOGNAME)
             
 
 
@@ -914,6 +1584,20 @@ def main():
         parser.add_argument('--partition_table_offset', '-pt',
                     help='Partition table offset (hex: 0x1234)',
                     default=None)
+        parser.add_argument('--jobs', '-j',
+                    help='Number of worker processes for partitions (dumps in batch mode) analysis',
+                    type=int,
+                    default=1)
+        parser.add_argument('--no_cache', '--no-cache',
+                    help='Do not use analysis cache',
+                    action='store_true')
+        parser.add_argument('--cache_dir',
+                    help='Analysis cache directory',
+                    default=esp32cache.CACHE_DIR_DEFAULT)
+        parser.add_argument('--cache_size',
+                    help='Analysis cache size limit, MB',
+                    type=int,
+                    default=esp32cache.CACHE_SIZE_DEFAULT)
 
         subparsers = parser.add_subparsers(
             dest='operation',
@@ -925,6 +1609,11 @@ def main():
             help='Load an image from binary file')
         parser_load_from_file.add_argument('filename', help='Firmware full image')
 
+        parser_batch = subparsers.add_parser(
+            'batch',
+            help='Analyze many full images, each to own output directory')
+        parser_batch.add_argument('inputs', nargs='+', help='Firmware full images: files, directories or glob patterns')
+
         parser_load_from_device = subparsers.add_parser(
             'load_from_device',
             help='Load an image directly from device')
@@ -936,13 +1625,30 @@ def main():
             )
         parser_load_from_device.add_argument(
             '--baud', '-b',
-            help='Serial port baud rate used when flashing/reading',
-            type=arg_auto_int,
+            help='Serial port baud rate used when flashing/reading. If "auto" - the fastest of {} which reads without errors'.format(BAUD_RATES),
+            type=arg_baud,
             default=os.environ.get('ESPTOOL_BAUD', esptool.ESPLoader.ESP_ROM_BAUD))
         parser_load_from_device.add_argument(
             '--read_efuses', '-e',
             help="Read EFUSEs from device",
             action='store_true')
+        parser_load_from_device.add_argument(
+            '--all_devices', '--all-devices', '-a',
+            help="With --port=auto read all connected devices at once, each to own <mac> output directory",
+            action='store_true')
+        parser_load_from_device_mode = parser_load_from_device.add_mutually_exclusive_group()
+        parser_load_from_device_mode.add_argument(
+            '--incremental_from', '--incremental-from',
+            help="Previous full dump of the device, only blocks with different MD5 are read",
+            default=None)
+        parser_load_from_device_mode.add_argument(
+            '--sparse',
+            help="Read bootloader and partitions table, then only not erased blocks (checked by MD5 on device)",
+            action='store_true')
+        parser_load_from_device_mode.add_argument(
+            '--resume',
+            help="Continue interrupted full read from its partial file ({})".format(espconsts.FILE_PARTIAL.format("<mac>")),
+            action='store_true')
 
         if len(sys.argv) == 1:
             printlog("Wrong arguments!!!")
@@ -952,50 +1658,69 @@ def main():
         args = parser.parse_args()
 
         esp = None
+        chip = None
         if args.board!=None:
-            pathboard = os.path.join("boards",args.board)
-            printlog("Try load additional board info from: {}".format(pathboard))
-            if not os.path.exists(pathboard):
-                printlog("Path not exists: " + pathboard)
-                return 0
-            pathconfig = os.path.join(pathboard, "config.txt")
-            printlog("Loading board config from: ")
-            if not os.path.exists(pathconfig):
-                printlog("Path not exists: " + pathconfig)
+            board = load_board_config(args.board)
+            if board is None:
                 return 0
-            with open(pathconfig, "rt") as fc:
-                for line in fc:
-                    ctype, cvalue = line.split(":")
-                    ctype=ctype.strip()
-                    cvalue=cvalue.strip()
-                    if ctype=="symbols":
-                        csymbols = [ os.path.join(pathboard, c) for c in cvalue.split() ]
-                        BOARD_EXT_SYMBOLS+=csymbols
-                    if ctype=="segment":
-                        csegment = list(cvalue.split())
-                        csegment[-1]=os.path.join(pathboard, csegment[-1])
-                        BOARD_EXT_SEGMENTS.append(tuple(csegment))
-
-
-        if args.operation=='load_from_device':
-            FIRMWARE_FULL_BIN = read_firmware_from_device(args.chip, args.port, args.baud, args.read_efuses)  
-            esp = FIRMWARE_ESP
-            # FIRMWARE_CHIP = esp.CHIP_NAME.lower()
-            FIRMWARE_CHIP = re.sub(r"[-()]", "", esp.CHIP_NAME.lower()) 
-
-            printlog("Writing full firmware to: {}".format(FILE_FIRMWARE))
-            with open(FILE_FIRMWARE,"wb") as f:
-                f.write(FIRMWARE_FULL_BIN)
+            BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS = board
+
+        cache = None
+        if not args.no_cache:
+            cache = esp32cache.AnalysisCache(args.cache_dir, args.cache_size*1024*1024)
+
+        # Partition table offset
+        partition_table_offsets = list(FIRMWARE_PARTITIONS_TABLE_OFFSETS)
+        if args.partition_table_offset!=None:
+            partition_table_offsets.append(int(args.partition_table_offset,16))
+
+        if args.operation=='load_from_device' and args.all_devices:
+            if args.port!='auto' or args.incremental_from:
+                printlog('--all_devices needs --port=auto and can\'t be used with --incremental_from')
+                return
+            devices = read_firmware_from_all_devices(args.chip, args.baud, args.read_efuses, args.sparse, partition_table_offsets, args.resume)
+            if not devices:
+                raise FatalError("Could not connect to any Espressif device.")
+            analyze_dumps(devices, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS, partition_table_offsets, args.jobs, cache)
+            return
+
+        elif args.operation=='load_from_device':
+            # flash is analyzed while being read
+            stream = FlashStream()
+            reader = threading.Thread(target=stream.run, args=(read_firmware_from_device, args.chip, args.port, args.baud, args.read_efuses, args.incremental_from, args.sparse, partition_table_offsets, args.resume))
+            reader.start()
+            try:
+                chip, FIRMWARE_FULL_BIN = stream.wait_start()
+                analyze_firmware(chip, FIRMWARE_FULL_BIN, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS, partition_table_offsets, args.jobs, cache, stream.wait)
+            finally:
+                reader.join()
+                # partial file is already removed, keep the dump even if its analysis failed
+                if stream.error is None and stream.data is not None:
+                    printlog("Writing full firmware to: {}".format(espconsts.FILE_FIRMWARE))
+                    with open(espconsts.FILE_FIRMWARE,"wb") as f:
+                        f.write(stream.data)
+            stream.check()
+            return
 
         elif args.operation=='load_from_file':
             if args.chip=='auto':
                 printlog('Please specify chip!')
                 return
-            FIRMWARE_CHIP = args.chip.lower()
+            chip = args.chip.lower()
             
             printlog("Reading firmware from: {}".format(args.filename))
-            with open(args.filename,"rb") as f:
-                FIRMWARE_FULL_BIN = f.read() 
+            FIRMWARE_IMAGE = MappedFile(args.filename)
+            FIRMWARE_FULL_BIN = FIRMWARE_IMAGE.view
+
+        elif args.operation=='batch':
+            if args.chip=='auto':
+                printlog('Please specify chip!')
+                return
+            chip = args.chip.lower()
+            if not get_chip_class(chip):
+                return
+            analyze_batch(chip, args.inputs, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS, partition_table_offsets, args.jobs, cache)
+            return
         else:
             printlog("Unknown operation: {}".format(args.operation))
             return
@@ -1004,101 +1729,17 @@ def main():
             printlog("Failed to read firmware!")
             return
 
-        chip_class = None
-        chip_def = espefuse.efuse_interface.SUPPORTED_CHIPS.get(FIRMWARE_CHIP, None)
-        if FIRMWARE_CHIP == 'esp8266':
-            chip_class = esptool.targets.ESP8266ROM
-        else:
-            if not chip_def:
-                printlog("Unsupported chip: {}".format(FIRMWARE_CHIP))
-                return
-            chip_class = chip_def.chip_class  # for get_chip_description, get_chip_features, get_crystal_freq
-
-        if not chip_class:
-            printlog("Unsupported chip: {}".format(FIRMWARE_CHIP))
-            return
-
-        # Handle ESP8266 specially
-        if FIRMWARE_CHIP == 'esp8266':
-            esp8266_analyze_firmware(FIRMWARE_FULL_BIN, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS)
-            return
-        
-        # Partition table offset
-        if args.partition_table_offset!=None:
-            FIRMWARE_PARTITIONS_TABLE_OFFSETS.append(int(args.partition_table_offset,16))
-   
-        flash = FIRMWARE_FULL_BIN
-        fbootloader = io.BytesIO( flash[ chip_class.BOOTLOADER_FLASH_OFFSET:] ) 
-        fbootloader_bytes: bytes = fbootloader.getvalue()
-        BOOTLOADER_IMAGE = esptool.bin_image.LoadFirmwareImage(FIRMWARE_CHIP, fbootloader_bytes )
-        image_size = BOOTLOADER_IMAGE.data_length + len(BOOTLOADER_IMAGE.stored_digest)
-        BOOTLOADER_IMAGE_BIN = flash[chip_class.BOOTLOADER_FLASH_OFFSET:chip_class.BOOTLOADER_FLASH_OFFSET+image_size]
-        printlog("Writing bootloader to: {}".format(FILE_BOOTLOADER))
-        with open(FILE_BOOTLOADER,"wb") as f:
-            f.write(flash[0x1000:0x1000+image_size])
-        printlog("Bootloader image info:")
-        printlog("=================================================================================")
-        fparsed=flash_image_info(FIRMWARE_CHIP, BOOTLOADER_IMAGE_BIN, FILE_BOOTLOADER)
-        if fparsed:
-            export_bin2elf( FIRMWARE_CHIP, BOOTLOADER_IMAGE_BIN, FILE_BOOTLOADER, None, None )
-        printlog("=================================================================================\n")
-
-
-        FIRMWARE_PARTITIONS_TABLE_OFFSET = None
-        for part_offset in FIRMWARE_PARTITIONS_TABLE_OFFSETS:
-            if flash[part_offset:part_offset+2] != esp32part.PartitionDefinition.MAGIC_BYTES:
-                printlog("No partition table found at: {:x}".format(part_offset))
-                continue
-            printlog("Partition table found at: {:x}".format(part_offset))
-            FIRMWARE_PARTITIONS_TABLE_OFFSET = part_offset
-            break
-        if FIRMWARE_PARTITIONS_TABLE_OFFSET==None:
-            printlog("Failed to find partitions table, exiting")
-            exit(1)
-
-        FIRMWARE_PARTITIONS_BIN = flash[FIRMWARE_PARTITIONS_TABLE_OFFSET:FIRMWARE_PARTITIONS_TABLE_OFFSET+FIRMWARE_PARTITIONS_TABLE_SIZE]
-        FIRMWARE_PARTITIONS_TABLE = esp32part.PartitionTable.from_binary(FIRMWARE_PARTITIONS_BIN)
-        printlog("Verifying partitions table...")
-        FIRMWARE_PARTITIONS_TABLE.verify()
-        output = FIRMWARE_PARTITIONS_TABLE.to_csv()
-
-        printlog("Writing partitions table to: {}".format(FILE_PARTITIONS_CSV))
-        with open(FILE_PARTITIONS_CSV, 'wt') as f:
-            f.write(output)
-
-        printlog("Writing partitions table to: {}".format(FILE_PARTITIONS_BIN))
-        with open(FILE_PARTITIONS_BIN, 'wb') as f:
-            f.write(FIRMWARE_PARTITIONS_BIN)
-
-        FIRMWARE_PARTITIONS_FNAMES = []
-        printlog("PARTITIONS:")
-        for i,p in enumerate(FIRMWARE_PARTITIONS_TABLE):
-            fname = "{}.{}.{}".format(FILE_PARTITIONS, i, p.name)
-            printlog("{:4} {} {}".format(i,p,fname))
-            FIRMWARE_PARTITIONS_FNAMES.append(fname)
-            with open(fname, "wb") as f:
-                f.write( FIRMWARE_FULL_BIN[ p.offset: p.offset+p.size] )
-            if p.type == esp32part.DATA_TYPE and p.subtype == esp32part.SUBTYPES[esp32part.DATA_TYPE]['nvs']:
-                parse_nvs_partition(fname)
-
-
-        printlog("\nAPP PARTITIONS INFO:")
-        printlog("=================================================================================")
-        for i,p in enumerate(FIRMWARE_PARTITIONS_TABLE):
-            if p.type != esp32part.APP_TYPE:
-                continue
-            printlog("Partition {}".format(p))
-            printlog("-------------------------------------------------------------------")
-            fparsed=flash_image_info( FIRMWARE_CHIP, FIRMWARE_FULL_BIN[ p.offset: p.offset+p.size], FIRMWARE_PARTITIONS_FNAMES[i] )
-            if fparsed:
-                export_bin2elf( FIRMWARE_CHIP, FIRMWARE_FULL_BIN[ p.offset: p.offset+p.size], FIRMWARE_PARTITIONS_FNAMES[i], BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS )
-        printlog("=================================================================================\n")
+        analyze_firmware(chip, FIRMWARE_FULL_BIN, BOARD_EXT_SYMBOLS, BOARD_EXT_SEGMENTS, partition_table_offsets, args.jobs, cache)
 
+    except FatalError:
+        raise
     except Exception as inst:
         printlog(type(inst))
         printlog(inst.args)
         printlog(inst)
     finally:
+        if FIRMWARE_IMAGE is not None:
+            FIRMWARE_IMAGE.close()
         log_close()
 
 
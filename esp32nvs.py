@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
-import os
+import os, sys
+import json
 import struct
 import base64
 import binascii
 import shutil
+import zlib
 from hexdump import hexdump
 from collections import OrderedDict
+from esp32utils import as_buffer
 
 nvs_types =  {
   0x01: "U8",
@@ -37,10 +40,10 @@ nvs_sector_states = {
         0xFFFFFFF0 : "CORRUPT"
 }
 
-namespaces = {}
+# entry states of bitmap byte as digits: bitmap is little endian, state of entry i is at bits (i%4)*2 of byte i/4
+entry_states_lut = [ "".join(str((b >> shift) & 3) for shift in (0, 2, 4, 6)) for b in range(256) ]
 
 BLOB_DATA_DIR   = "blob_data"
-BLOD_DATA_INDEX = 0
 
 def ASHEX(b):
     return " ".join(map(hex, b))
@@ -52,520 +55,612 @@ def create_empty_dir(fname):
     if not os.path.exists(fname):
         os.makedirs(fname)
 
-def dump_nvs_entries(entries, entry_state_bitmap, fpos):
-    entries_out = []
-    i = 0
-    while i < 126:
+class NvsEntry(object):
+    """ Entry of NVS page, value is decoded for used entries only (type is not empty/ANY) """
+    index = 0
+    offset = 0
+    state = None
+
+    def __init__(self, index, offset, state, raw):
+        self.index = index
+        self.offset = offset
+        self.state = state
+        self.raw = raw
+        self.ns = raw[0]
+        self.type = raw[1]
+        self.span = raw[2]
+        self.chunk_index = raw[3]
+        self.key = None
+        self.payload = None # data of the following span-1 entries (STR, BLOB, BLOB_DATA)
+        self.fields = {}    # decoded value as in json output: entry_data_type, entry_data_size, entry_data...
+        self.crc_ok = None      # CRC32 checks, None if not verified
+        self.data_crc_ok = None
+
+    @property
+    def corrupt(self):
+        return self.crc_ok is False or self.data_crc_ok is False
+
+    @property
+    def type_name(self):
+        return nvs_types.get(self.type, "0x{:02x}".format(self.type))
+
+    @property
+    def used(self):
+        return self.type != 0 and self.type_name != "ANY"
+
+    def to_json(self, namespaces={}):
         entry_data = {}
-        print("  Entry {} (offset = {:08x})".format(i,fpos+i*32))
-        print("  Bitmap State : %s" % (entry_state_descs[int(entry_state_bitmap[i])]))
-        entry_data["entry_state"] = entry_state_descs[int(entry_state_bitmap[i])]
-
-        entry = entries[i]
-        state = entry_state_bitmap[i]
+        entry_data["entry_state"] = self.state
+        entry_data["entry_ns_index"] = self.ns
+        if(self.ns != 0 and self.ns in namespaces):
+            entry_data["entry_ns"] = namespaces[self.ns]
+        entry_data["entry_type"] = self.type_name
+        entry_data["entry_span"] = self.span
+        entry_data["entry_chunk_index"] = self.chunk_index
+        entry_data["entry_key"] = self.key
+        entry_data.update(self.fields)
+        if self.crc_ok is not None:
+            entry_data["entry_crc_ok"] = self.crc_ok
+        if self.data_crc_ok is not None:
+            entry_data["entry_data_crc_ok"] = self.data_crc_ok
+        return entry_data
+
+
+class NvsPage(object):
+    """ Parsed NVS page: header and entries in order of visiting (entries spanned by value are skipped) """
+    index = 0
+    offset = 0
+
+    def __init__(self, index, offset, raw, verify=False, decode=True, namespaces=None):
+        self.index = index
+        self.offset = offset
+        self.raw = raw
+        # namespaces table of the parser, filled by this and previous pages
+        self.namespaces = {} if namespaces is None else namespaces
+        self.state = nvs_sector_states.get(struct.unpack("<I", raw[0:4])[0], "UNKNOWN") # damaged state word
+        self.seq_no = struct.unpack("<I", raw[4:8])[0]
+        self.version = (raw[8] ^ 0xff) + 1
+        # raw[9:28] unused
+        self.crc_32 = struct.unpack("<I", raw[28:32])[0]
+        self.crc_ok = None
+        if verify and self.state != "EMPTY":
+            self.crc_ok = zlib.crc32(raw[4:28], 0xFFFFFFFF) == self.crc_32
+
+        self.entry_state_bitmap = decode_entry_state_bitmap(raw[32:64])
+        self.entries_empty   = self.entry_state_bitmap.count('3')
+        self.entries_written = self.entry_state_bitmap.count('2')
+        self.entries_erased  = self.entry_state_bitmap.count('0')
+        self.entries = parse_nvs_entries(raw, offset+64, self.entry_state_bitmap, verify, decode, self.namespaces)
+
+    def to_json(self):
+        page_data = {}
+        page_data["page_state"] = self.state
+        page_data["page_seq_no"] = self.seq_no
+        page_data["page_version"] = self.version
+        page_data["page_crc_32"] = self.crc_32
+        if self.crc_ok is not None:
+            page_data["page_crc_ok"] = self.crc_ok
+        page_data["page_entry_state_bitmap"] = self.entry_state_bitmap
+        page_data["entries"] = [ e.to_json(self.namespaces) for e in self.entries if e.used ]
+        return page_data
+
+
+def decode_entry_state_bitmap(bitmap):
+    """ 32 bytes bitmap to string of 126 entry states: '3' - empty, '2' - written, '0' - erased """
+    return "".join([ entry_states_lut[b] for b in bitmap ])[:126]
+
+
+def decode_nvs_entry(entry, namespaces):
+    """ Decode key and value of used entry to entry.key and entry.fields, namespace definition is added to namespaces """
+    entry_type = entry.type_name
+    entry.key = bytes(entry.raw[8:24]).split(b'\0', 1)[0].decode('latin-1')
+
+    data = entry.raw[24:]
+    entry_data = entry.fields
+
+    if(entry_type == "U8"):
+        data = struct.unpack("<B", data[0:1])[0]
+        if(entry.ns == 0):
+            namespaces[data] = entry.key
+        entry_data["entry_data_type"] = "U8"
+        entry_data["entry_data"] = data
+
+    elif(entry_type == "I8"):
+        data = struct.unpack("<b", data[0:1])[0]
+        entry_data["entry_data_type"] = "I8"
+        entry_data["entry_data"] = data
+
+    elif(entry_type == "U16"):
+        data = struct.unpack("<H", data[0:2])[0]
+        entry_data["entry_data_type"] = "U16"
+        entry_data["entry_data"] = data
     
-        entry_ns = entry[0]
-        entry_type = entry[1]
-        entry_span = entry[2]
-        chunk_index = entry[3]
-
-        key = entry[8:24]
-
-        data = entry[24:]
-        if(entry_type == 0):
-            i += 1
-            continue
-
-        if(nvs_types[entry_type] == "ANY"):
-            i += 1
-            continue
-
-        decoded_key = ''
-        for c in key:
-            if(c == 0):
-                break
-            decoded_key += chr(c)
-
-        key = decoded_key
-
-        print("    Written Entry %d" % (i))
-        print("      NS Index : %d" % (entry_ns))
-        entry_data["entry_ns_index"] = entry_ns
-
-        if(entry_ns != 0 and entry_ns in namespaces):
-            print("          NS : %s" % (namespaces[entry_ns]))
-            entry_data["entry_ns"] = namespaces[entry_ns]
-
-        print("      Type : %s" % (nvs_types[entry_type]))
-        print("      Span : %d" % (entry_span))
-        print("      ChunkIndex : %d" % (chunk_index))
-        print("      Key : " + key)
-        entry_data["entry_type"] = nvs_types[entry_type]
-        entry_data["entry_span"] = entry_span
-        entry_data["entry_chunk_index"] = chunk_index
-        entry_data["entry_key"] = key
-
-
-        if(nvs_types[entry_type] == "U8"):
-            data = struct.unpack("<B", data[0:1])[0]
-            print("      Data (U8) : 0x{:x}".format(data))
-            if(entry_ns == 0):
-                namespaces[data] = key
-            entry_data["entry_data_type"] = "U8"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "I8"):
-            data = struct.unpack("<b", data[0:1])[0]
-            print("      Data (I8) : 0x{:x}".format(data))
-            entry_data["entry_data_type"] = "I8"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "U16"):
-            data = struct.unpack("<H", data[0:2])[0]
-            print("      Data (U16) : 0x{:02x}".format(data))
-            entry_data["entry_data_type"] = "U16"
-            entry_data["entry_data"] = data
-        
-        elif(nvs_types[entry_type] == "I16"):
-            data = struct.unpack("<h", data[0:2])[0]
-            print("      Data (I16) : 0x{:02x}".format(data))
-            entry_data["entry_data_type"] = "I16"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "U32"):
-            data = struct.unpack("<I", data[0:4])[0]
-            print("      Data (U32) : 0x{:04x}".format(data))
-            entry_data["entry_data_type"] = "U32"
-            entry_data["entry_data"] = data
-        
-        elif(nvs_types[entry_type] == "I32"):
-            data = struct.unpack("<i", data[0:4])[0]
-            print("      Data (I32) : 0x{:04x}".format(data))
-            entry_data["entry_data_type"] = "I32"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "U64"):
-            data = struct.unpack("<Q", data[0:8])[0]
-            print("      Data (U64) : 0x{:08x}".format(data))
-            entry_data["entry_data_type"] = "U64"
-            entry_data["entry_data"] = data
-        
-        elif(nvs_types[entry_type] == "I64"):
-            data = struct.unpack("<q", data[0:8])[0]
-            print("      Data (I64) : 0x{:08x}".format(data))
-            entry_data["entry_data_type"] = "I64"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "STR"):
-            str_size = struct.unpack("<H", data[0:2])[0]
-
-            print("      String :")
-            entry_data["entry_data_type"] = "STR"
-            print("        Size : %d " % (str_size))
-            print("        Rsv2 : %s " % ASHEX(data[2:4]))
-            print("        CRC32: %s " % ASHEX(data[4:8]))
-            entry_data["entry_data_size"] = str_size
-            data = b'' 
-            for x in range(1, entry_span):
-                i += 1
-                data += entries[i]
-            data = data[0:str_size-1].decode('ascii')
-            print("        Data : %s" % (data))
-            entry_data["entry_data"] = str(data)
-
-        elif(nvs_types[entry_type] == "BLOB_DATA"):
-            blob_data_size = struct.unpack("<H", data[0:2])[0]
-            print("      Blob Data :")
-            entry_data["entry_data_type"] = "BLOB_DATA"
-            print("        Size : %d " % (blob_data_size))
-            entry_data["entry_data_size"] = blob_data_size
-            data = b'' 
-            for x in range(1, entry_span):
-                i += 1
-                data += entries[i]
-            print("        Data :")
-            hexdump(data[:blob_data_size])
-            entry_data["entry_data"] = base64.b64encode(data[:blob_data_size]).decode('ascii')
-
-        elif(nvs_types[entry_type] == "BLOB"):
-            blob_size = struct.unpack("<H", data[0:2])[0]
-            print("      Data (Blob) :")
-            entry_data["entry_data_type"] = "BLOB"
-            print("        Size : %d " % (blob_size))
-            entry_data["entry_data_size"] = blob_size
-            data = b'' 
-            for x in range(1, entry_span):
-                i += 1
-                data += entries[i]
-            print("        Data :")
-            hexdump(data[:blob_size])
-            entry_data["entry_data"] = base64.b64encode(data[:blob_size]).decode('ascii')
-
-        elif(nvs_types[entry_type] == "BLOB_IDX"):
-            idx_size = struct.unpack("<I", data[0:4])[0]
-            chunk_count = struct.unpack("<B", data[5:6])[0]
-            chunk_start = struct.unpack("<B", data[6:7])[0]
-            print("      Blob IDX :")
-            entry_data["entry_data_type"] = "BLOB_IDX"
-            print("        Size        : %d " % (idx_size))
-            print("        Chunk Count : %d " % (chunk_count))
-            print("        Chunk Start  : %d " % (chunk_start))
-            entry_data["entry_data_size"] = idx_size
-            entry_data["entry_data_chunk_count"] = chunk_count
-            entry_data["entry_data_chunk_start"] = chunk_start
-
+    elif(entry_type == "I16"):
+        data = struct.unpack("<h", data[0:2])[0]
+        entry_data["entry_data_type"] = "I16"
+        entry_data["entry_data"] = data
+
+    elif(entry_type == "U32"):
+        data = struct.unpack("<I", data[0:4])[0]
+        entry_data["entry_data_type"] = "U32"
+        entry_data["entry_data"] = data
+    
+    elif(entry_type == "I32"):
+        data = struct.unpack("<i", data[0:4])[0]
+        entry_data["entry_data_type"] = "I32"
+        entry_data["entry_data"] = data
+
+    elif(entry_type == "U64"):
+        data = struct.unpack("<Q", data[0:8])[0]
+        entry_data["entry_data_type"] = "U64"
+        entry_data["entry_data"] = data
+
+    elif(entry_type == "I64"):
+        data = struct.unpack("<q", data[0:8])[0]
+        entry_data["entry_data_type"] = "I64"
+        entry_data["entry_data"] = data
+
+    elif(entry_type in ["STR", "BLOB_DATA", "BLOB"]):
+        size = struct.unpack("<H", data[0:2])[0]
+        entry_data["entry_data_type"] = entry_type
+        entry_data["entry_data_size"] = size
+        data = entry.payload
+        if entry_type == "STR":
+            entry_data["entry_data"] = str(data[0:size-1], 'ascii')
         else:
-            print("      Data : %s" % (str(data)))
-            entry_data["entry_data"] = str(data)
-
-        entries_out.append(entry_data)
-        i += 1
-        print("")
-    return entries_out
-
-def nvs2txt(fh):
-    pages = []
-    fh.seek(0, os.SEEK_END)
-    file_len = fh.tell()
-
-    sector_pos = 0
-    x = 0
-    while(sector_pos < file_len):
-        page_data = {}
-
-        fh.seek(sector_pos)
-        
-        ofs_page = fh.tell()
-
-        raw_page_state = fh.read(4)
-        page_state = nvs_sector_states[struct.unpack("<I", raw_page_state)[0]]
-
-        raw_seq_no = fh.read(4)
-        seq_no = struct.unpack("<I", raw_seq_no)[0]
-
-        raw_version = fh.read(1)
-        version = (ord(raw_version) ^ 0xff) + 1
-
-        print( "Page {} ( offset={:08x} )".format(x, ofs_page))
-        print("  page state   : {} ({}) ".format(page_state, ASHEX(raw_page_state)))
-        print("  page seq no. : {} ({}) ".format(seq_no, ASHEX(raw_seq_no)))
-        print("  page version : {} ({}) ".format(version, ASHEX(raw_version)))
-       
-        page_data["page_state"] = page_state
-        page_data["page_seq_no"] = seq_no
-        page_data["page_version"] = version
-
-        fh.read(19) # unused
-
-        ofs_crc_32 = fh.tell()
-        crc_32 = struct.unpack("<I", fh.read(4))[0]
-        print("  crc32 : 0x{:04x} (offset={:08x})".format(crc_32, ofs_crc_32))
-        page_data["page_crc_32"] = crc_32
-
-        entry_state_bitmap = fh.read(32)
-        entry_state_bitmap_decoded = ''
-
-        for entry_num in range(0, 126):
-            bitnum = entry_num * 2
-            byte_index = int(bitnum / 8)
-            temp = entry_state_bitmap[byte_index]
-            
-            temp = temp >> (6 - (bitnum % 8))
-            temp = temp & 3
-            entry_state_bitmap_decoded = entry_state_bitmap_decoded + str(temp)
-
-        print("  page entry state bitmap (decoded) : %s" % (entry_state_bitmap_decoded))
-        page_data["page_entry_state_bitmap"] = entry_state_bitmap_decoded 
-        sector_pos += 4096
-        x += 1
-
-        entries = []
-        entry_data = ''
-        ofs_entries = fh.tell()
-        print("\n  Read entries data ( offset = {:08x} ):".format(ofs_entries))
-        for entry in entry_state_bitmap_decoded:
-            entry_data = fh.read(32)
-            entries.append(entry_data)
-
-        page_data["entries"] = dump_nvs_entries(entries, entry_state_bitmap_decoded, ofs_entries )
-
-        print("")
-        print("")
-        print("------------------------------------------------------------------------------")
-        print("")
-        pages.append(page_data)
-
-    print("")
-    return pages
-
-
-def parse_nvs_entries(entries, entry_state_bitmap):
+            entry_data["entry_data"] = base64.b64encode(data[:size]).decode('ascii')
+
+    elif(entry_type == "BLOB_IDX"):
+        idx_size = struct.unpack("<I", data[0:4])[0]
+        # size(4), chunk count(1), chunk start(1), reserved(2)
+        chunk_count = struct.unpack("<B", data[4:5])[0]
+        chunk_start = struct.unpack("<B", data[5:6])[0]
+        entry_data["entry_data_type"] = "BLOB_IDX"
+        entry_data["entry_data_size"] = idx_size
+        entry_data["entry_data_chunk_count"] = chunk_count
+        entry_data["entry_data_chunk_start"] = chunk_start
+
+    else:
+        entry_data["entry_data"] = str(bytes(data))
+
+
+def parse_nvs_entries(page, ofs_entries, entry_state_bitmap, verify=False, decode=True, namespaces=None):
+    """ Entries of page are memoryview slices of it, value spanning several entries is one slice too.
+        verify - check entry and data CRC32, decode - decode keys and values (False for verification only),
+        namespaces - table to add namespace definitions to
+    """
+    if namespaces is None:
+        namespaces = {}
     entries_out = []
     i = 0
     while i < 126:
-        entry_data = {}
-        entry_data["entry_state"] = entry_state_descs[int(entry_state_bitmap[i])]
-
-        entry = entries[i]
-        state = entry_state_bitmap[i]
-    
-        entry_ns = entry[0]
-        entry_type = entry[1]
-        entry_span = entry[2]
-        chunk_index = entry[3]
-
-        key = entry[8:24]
-
-        data = entry[24:]
-        if(entry_type == 0):
-            i += 1
+        entry = NvsEntry(i, ofs_entries+i*32, entry_state_descs[int(entry_state_bitmap[i])], page[64+i*32:96+i*32])
+        entries_out.append(entry)
+        i += 1
+        if not entry.used:
             continue
 
-        if(nvs_types[entry_type] == "ANY"):
-            i += 1
+        entry_type = entry.type_name
+        if entry_type in ["STR", "BLOB_DATA", "BLOB"]:
+            entry.payload = page[64+i*32:64+(i+entry.span-1)*32]
+            i += max(entry.span-1, 0)
+
+        if verify:
+            # entry CRC covers ns, type, span, chunk index, key and data; data CRC - value of size bytes
+            raw = entry.raw
+            entry.crc_ok = zlib.crc32(raw[8:32], zlib.crc32(raw[0:4], 0xFFFFFFFF)) == struct.unpack("<I", raw[4:8])[0]
+            if entry.payload is not None:
+                size = struct.unpack("<H", raw[24:26])[0]
+                entry.data_crc_ok = zlib.crc32(entry.payload[:size], 0xFFFFFFFF) == struct.unpack("<I", raw[28:32])[0]
+        if not decode:
             continue
 
-        decoded_key = ''
-        for c in key:
-            if(c == 0):
-                break
-            decoded_key += chr(c)
-
-        key = decoded_key
-
-        if(entry_ns != 0):
-            entry_data["entry_ns"] = entry_ns
-
-        entry_data["entry_type"] = nvs_types[entry_type]
-        entry_data["entry_span"] = entry_span
-        entry_data["entry_chunk_index"] = chunk_index
-        entry_data["entry_key"] = key
-
-        if(nvs_types[entry_type] == "U8"):
-            data = struct.unpack("<B", data[0:1])[0]
-            if(entry_ns == 0):
-                namespaces[data] = key
-            entry_data["entry_data_type"] = "U8"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "I8"):
-            data = struct.unpack("<b", data[0:1])[0]
-            entry_data["entry_data_type"] = "I8"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "U16"):
-            data = struct.unpack("<H", data[0:2])[0]
-            entry_data["entry_data_type"] = "U16"
-            entry_data["entry_data"] = data
-        
-        elif(nvs_types[entry_type] == "I16"):
-            data = struct.unpack("<h", data[0:2])[0]
-            entry_data["entry_data_type"] = "I16"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "U32"):
-            data = struct.unpack("<I", data[0:4])[0]
-            entry_data["entry_data_type"] = "U32"
-            entry_data["entry_data"] = data
-        
-        elif(nvs_types[entry_type] == "I32"):
-            data = struct.unpack("<i", data[0:4])[0]
-            entry_data["entry_data_type"] = "I32"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "U64"):
-            data = struct.unpack("<Q", data[0:8])[0]
-            entry_data["entry_data_type"] = "U64"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "I64"):
-            data = struct.unpack("<q", data[0:8])[0]
-            entry_data["entry_data_type"] = "I64"
-            entry_data["entry_data"] = data
-
-        elif(nvs_types[entry_type] == "STR"):
-            str_size = struct.unpack("<H", data[0:2])[0]
-            entry_data["entry_data_type"] = "STR"
-            entry_data["entry_data_size"] = str_size
-            data = b'' 
-            for x in range(1, entry_span):
-                i += 1
-                data += entries[i]
-            data = data[0:str_size-1].decode('ascii')
-            entry_data["entry_data"] = str(data)
-
-        elif(nvs_types[entry_type] == "BLOB_DATA"):
-            blob_data_size = struct.unpack("<H", data[0:2])[0]
-            entry_data["entry_data_type"] = "BLOB_DATA"
-            entry_data["entry_data_size"] = blob_data_size
-            data = b'' 
-            for x in range(1, entry_span):
-                i += 1
-                data += entries[i]
-            #hexdump(data[:blob_data_size])
-            entry_data["entry_data"] = base64.b64encode(data[:blob_data_size]).decode('ascii')
-
-        elif(nvs_types[entry_type] == "BLOB"):
-            blob_size = struct.unpack("<H", data[0:2])[0]
-            entry_data["entry_data_type"] = "BLOB"
-            entry_data["entry_data_size"] = blob_size
-            data = b'' 
-            for x in range(1, entry_span):
-                i += 1
-                data += entries[i]
-            #hexdump(data[:blob_size])
-            entry_data["entry_data"] = base64.b64encode(data[:blob_size]).decode('ascii')
-
-        elif(nvs_types[entry_type] == "BLOB_IDX"):
-            idx_size = struct.unpack("<I", data[0:4])[0]
-            chunk_count = struct.unpack("<B", data[5:6])[0]
-            chunk_start = struct.unpack("<B", data[6:7])[0]
-            entry_data["entry_data_type"] = "BLOB_IDX"
-            entry_data["entry_data_size"] = idx_size
-            entry_data["entry_data_chunk_count"] = chunk_count
-            entry_data["entry_data_chunk_start"] = chunk_start
-
-        else:
-            entry_data["entry_data"] = str(data)
-
-        entries_out.append(entry_data)
-        i += 1
+        decode_nvs_entry(entry, namespaces)
 
     return entries_out
 
 
-def get_entries(entries, ename, etype):
-    chunks = dict()
-    chsize = 0
-    for pc in entries:
-        if pc["entry_state"]=="Written" and pc["entry_type"]==etype and pc["entry_key"]==ename:
-            chunks[ pc["entry_chunk_index"] ]=pc
-            chsize += pc["entry_data_size"]
-
-    chunks = OrderedDict( sorted(chunks.items()) )
-    return (chsize, chunks)
-
-def entries2cvs(parsed):
-    #print(namespaces)
-    for ni,nn in namespaces.items():
-        print("{},namespace,,".format(nn))
-        for p in parsed:
-            p_entry_state = p["entry_state"]
-            if p_entry_state!="Written":
+def nvs_entry_value(entry, chunks, default=None):
+    """ Value of decoded entry: int for integer types, str for STR, bytes for blobs.
+        chunks - {chunk index: BLOB_DATA entry} of the key, used for BLOB_IDX
+    """
+    entry_type = entry.type_name
+    if entry_type == "STR":
+        return entry.fields["entry_data"]
+    if entry_type == "BLOB":
+        return bytes(entry.payload[:entry.fields["entry_data_size"]])
+    if entry_type == "BLOB_IDX":
+        # chunks of the current blob version only
+        count, start = entry.fields["entry_data_chunk_count"], entry.fields["entry_data_chunk_start"]
+        data = b''.join( chunks[i].payload[:chunks[i].fields["entry_data_size"]]
+                         for i in range(start, start + count) if i in chunks )
+        return data[:entry.fields["entry_data_size"]]
+    return entry.fields.get("entry_data", default)
+
+
+class NvsPartition(object):
+    """ Parsed NVS partition: pages and index of written entries
+          namespaces - namespace index: name
+          entries    - (namespace index, key): live entry (BLOB_DATA chunks are not there)
+          chunks     - (namespace index, key): {chunk index: BLOB_DATA entry}
+          versions   - (namespace index, key): [(page, entry)] written and erased entries, oldest first
+    """
+    def __init__(self, pages, index=True):
+        self.pages = pages
+        self.namespaces = {}
+        self.namespace_ids = {}
+        self.entries = {}
+        self.chunks = {}
+        self.versions = {}
+        if not index:
+            return
+        # pages in order they were written, so the newest of the same entries wins
+        for page in sorted(pages, key=lambda p: p.seq_no):
+            for e in page.entries:
+                if not e.used or e.state == "Empty":
+                    continue
+                self.versions.setdefault((e.ns, e.key), []).append((page, e))
+                if e.state != "Written":
+                    continue
+                if e.ns == 0:
+                    self.namespaces[e.fields["entry_data"]] = e.key
+                    self.namespace_ids[e.key] = e.fields["entry_data"]
+                elif e.type_name == "BLOB_DATA":
+                    self.chunks.setdefault((e.ns, e.key), {})[e.chunk_index] = e
+                else:
+                    self.entries[(e.ns, e.key)] = e
+
+    def __iter__(self):
+        return iter(self.pages)
+
+    def blob_chunks(self, ns, key):
+        """ BLOB_DATA chunks of blob ordered by chunk index """
+        chunks = self.chunks.get((ns, key), {})
+        return [ chunks[i] for i in sorted(chunks) ]
+
+    def get(self, namespace, key, default=None):
+        """ Live value of key in namespace (name or index): int for integer types,
+            str for STR, bytes for blobs. Returns default if there is no such key.
+        """
+        ns = self.namespace_ids.get(namespace, namespace)
+        entry = self.entries.get((ns, key), None)
+        if entry is None:
+            return default
+        return nvs_entry_value(entry, self.chunks.get((ns, key), {}), default)
+
+    def history(self, namespace, key):
+        """ All versions of key in namespace (name or index), superseded and erased ones too:
+            [(page, entry)] ordered by page seq no and entry position
+        """
+        ns = self.namespace_ids.get(namespace, namespace)
+        return self.versions.get((ns, key), [])
+
+    def corrupt(self):
+        """ Pages and entries which failed CRC32 check or have unknown page state: [(page, entry or None for page header)] """
+        bad = []
+        for page in self.pages:
+            if page.crc_ok is False or page.state == "UNKNOWN":
+                bad.append((page, None))
+            bad += [ (page, e) for e in page.entries if e.corrupt ]
+        return bad
+
+
+class NvsParser(object):
+    """ Parser of one NVS partition. All state (namespaces table) is kept in the parser,
+        so partitions can be parsed by separate parsers in parallel threads.
+        verify - check CRC32 of pages and entries, decode=False skips values decoding and indexing
+    """
+    def __init__(self, verify=False, decode=True):
+        self.verify = verify
+        self.decode = decode
+        self.namespaces = {}
+
+    def pages(self, fh):
+        """ Generator of NvsPage of partition (MappedFile, file, buffer or bytes), page is parsed when it is consumed """
+        data = as_buffer(fh)
+        for x, pos in enumerate(range(0, len(data), 4096)):
+            yield NvsPage(x, pos, data[pos:pos+4096], self.verify, self.decode, self.namespaces)
+
+    def parse(self, fh):
+        return NvsPartition(list(self.pages(fh)), self.decode)
+
+    def get(self, fh, namespace, key, default=None):
+        """ Live value of key in namespace (name or index) as NvsPartition.get, without parsing whole
+            partition: pages are visited newest first by seq_no and the search stops at the newest
+            Written entry (and chunks of its blob). Only entries on the way are decoded.
+        """
+        data = as_buffer(fh)
+        offsets = range(0, len(data), 4096)
+        # reverse of the order NvsPartition indexes pages in, so the first match is the one it keeps
+        order = sorted(range(len(offsets)), key=lambda x: struct.unpack("<I", data[offsets[x]+4:offsets[x]+8])[0])
+        parsed = {}
+
+        def newest(ns, name):
+            """ Written entries of ns with key name, newest first """
+            name = name.encode('latin-1')
+            pattern = name if len(name) >= 16 else name + b'\0'
+            for x in reversed(order):
+                raw = data[offsets[x]:offsets[x]+4096]
+                if pattern not in bytes(raw):
+                    continue # key is not on page, no need to parse it
+                if x not in parsed:
+                    parsed[x] = NvsPage(x, offsets[x], raw, self.verify, False)
+                for e in reversed(parsed[x].entries):
+                    if e.ns == ns and e.state == "Written" and e.used and bytes(e.raw[8:24]).split(b'\0', 1)[0] == name:
+                        decode_nvs_entry(e, self.namespaces)
+                        yield e
+
+        ns = namespace
+        if not isinstance(namespace, int):
+            ns = next(( e.fields["entry_data"] for e in newest(0, namespace) ), None)
+        if ns is None or ns == 0:
+            return default
+        entry = next(( e for e in newest(ns, key) if e.type_name != "BLOB_DATA" ), None)
+        if entry is None:
+            return default
+        chunks = {}
+        if entry.type_name == "BLOB_IDX":
+            needed = set(range(entry.fields["entry_data_chunk_start"], entry.fields["entry_data_chunk_start"] + entry.fields["entry_data_chunk_count"]))
+            for e in newest(ns, key):
+                if e.type_name == "BLOB_DATA" and e.chunk_index in needed and e.chunk_index not in chunks:
+                    chunks[e.chunk_index] = e
+                    if len(chunks) == len(needed):
+                        break
+        return nvs_entry_value(entry, chunks, default)
+
+
+def nvs_pages(fh, verify=False, decode=True):
+    """ Pages of partition parsed by own NvsParser as they are consumed """
+    return NvsParser(verify, decode).pages(fh)
+
+def nvs_parse(fh, verify=False, decode=True):
+    """ Parse NVS partition (MappedFile, file, buffer or bytes) once into NvsPartition """
+    return NvsParser(verify, decode).parse(fh)
+
+def nvs_get(fh, namespace, key, default=None):
+    """ Live value of one key of NVS partition, only pages up to the newest version of it are parsed """
+    return NvsParser().get(fh, namespace, key, default)
+
+
+def nvs_render_text_entry(entry, f, namespaces={}):
+    print("  Entry {} (offset = {:08x})".format(entry.index, entry.offset), file=f)
+    print("  Bitmap State : %s" % (entry.state), file=f)
+    if not entry.used:
+        return
+
+    entry_type = entry.type_name
+    entry_data = entry.fields
+    data = entry.raw[24:]
+
+    print("    Written Entry %d" % (entry.index), file=f)
+    print("      NS Index : %d" % (entry.ns), file=f)
+    if(entry.ns != 0 and entry.ns in namespaces):
+        print("          NS : %s" % (namespaces[entry.ns]), file=f)
+    print("      Type : %s" % (entry_type), file=f)
+    print("      Span : %d" % (entry.span), file=f)
+    print("      ChunkIndex : %d" % (entry.chunk_index), file=f)
+    print("      Key : " + entry.key, file=f)
+    if entry.crc_ok is not None:
+        print("      CRC32 check : %s" % ("OK" if entry.crc_ok else "BAD"), file=f)
+    if entry.data_crc_ok is not None:
+        print("      Data CRC32 check : %s" % ("OK" if entry.data_crc_ok else "BAD"), file=f)
+
+    if(entry_type == "U8"):
+        print("      Data (U8) : 0x{:x}".format(entry_data["entry_data"]), file=f)
+    elif(entry_type == "I8"):
+        print("      Data (I8) : 0x{:x}".format(entry_data["entry_data"]), file=f)
+    elif(entry_type == "U16"):
+        print("      Data (U16) : 0x{:02x}".format(entry_data["entry_data"]), file=f)
+    elif(entry_type == "I16"):
+        print("      Data (I16) : 0x{:02x}".format(entry_data["entry_data"]), file=f)
+    elif(entry_type == "U32"):
+        print("      Data (U32) : 0x{:04x}".format(entry_data["entry_data"]), file=f)
+    elif(entry_type == "I32"):
+        print("      Data (I32) : 0x{:04x}".format(entry_data["entry_data"]), file=f)
+    elif(entry_type == "U64"):
+        print("      Data (U64) : 0x{:08x}".format(entry_data["entry_data"]), file=f)
+    elif(entry_type == "I64"):
+        print("      Data (I64) : 0x{:08x}".format(entry_data["entry_data"]), file=f)
+
+    elif(entry_type == "STR"):
+        print("      String :", file=f)
+        print("        Size : %d " % (entry_data["entry_data_size"]), file=f)
+        print("        Rsv2 : %s " % ASHEX(data[2:4]), file=f)
+        print("        CRC32: %s " % ASHEX(data[4:8]), file=f)
+        print("        Data : %s" % (entry_data["entry_data"]), file=f)
+
+    elif(entry_type == "BLOB_DATA" or entry_type == "BLOB"):
+        print("      Blob Data :" if entry_type == "BLOB_DATA" else "      Data (Blob) :", file=f)
+        print("        Size : %d " % (entry_data["entry_data_size"]), file=f)
+        print("        Data :", file=f)
+        dump = hexdump(bytes(entry.payload[:entry_data["entry_data_size"]]), result='return')
+        if dump:
+            print(dump, file=f)
+
+    elif(entry_type == "BLOB_IDX"):
+        print("      Blob IDX :", file=f)
+        print("        Size        : %d " % (entry_data["entry_data_size"]), file=f)
+        print("        Chunk Count : %d " % (entry_data["entry_data_chunk_count"]), file=f)
+        print("        Chunk Start  : %d " % (entry_data["entry_data_chunk_start"]), file=f)
+
+    else:
+        print("      Data : %s" % (entry_data["entry_data"]), file=f)
+
+    print("", file=f)
+
+def nvs_render_text(pages, f):
+    """ Human readable dump of pages (NvsPartition or NvsPage iterable) and all entries """
+    for page in pages:
+        raw = page.raw
+        print( "Page {} ( offset={:08x} )".format(page.index, page.offset), file=f)
+        print("  page state   : {} ({}) ".format(page.state, ASHEX(raw[0:4])), file=f)
+        print("  page seq no. : {} ({}) ".format(page.seq_no, ASHEX(raw[4:8])), file=f)
+        print("  page version : {} ({}) ".format(page.version, ASHEX(raw[8:9])), file=f)
+        print("  crc32 : 0x{:04x} (offset={:08x})".format(page.crc_32, page.offset + 28), file=f)
+        if page.crc_ok is not None:
+            print("  crc32 check : %s" % ("OK" if page.crc_ok else "BAD"), file=f)
+        print("  page entry state bitmap (decoded) : %s" % (page.entry_state_bitmap), file=f)
+
+        print("\n  Read entries data ( offset = {:08x} ):".format(page.offset + 64), file=f)
+        for entry in page.entries:
+            nvs_render_text_entry(entry, f, page.namespaces)
+
+        print("", file=f)
+        print("", file=f)
+        print("------------------------------------------------------------------------------", file=f)
+        print("", file=f)
+
+    print("", file=f)
+
+def nvs_render_json(pages, f, compact=False):
+    """ Json list of pages (NvsPartition or NvsPage iterable), written page by page """
+    first = True
+    for page in pages:
+        if compact:
+            f.write(("[" if first else ",") + json.dumps(page.to_json(), separators=(",", ":")))
+        else:
+            # same layout as json.dumps(list, indent=4)
+            f.write(("[\n" if first else ",\n") + "\n".join( "    " + line for line in json.dumps(page.to_json(), indent=4).split("\n") ))
+        first = False
+    if first:
+        f.write("[]")
+    else:
+        f.write("]" if compact else "\n]")
+
+def nvs_render_ndjson(pages, f):
+    """ One json line per used entry with its page index, state and seq no, written as pages are parsed """
+    for page in pages:
+        for e in page.entries:
+            if not e.used:
                 continue
-            p_entry_ns = p.get("entry_ns",None)
-            if p_entry_ns==None or p_entry_ns!=ni: #None - new namespace
+            entry_data = { "page_index": page.index, "page_state": page.state, "page_seq_no": page.seq_no }
+            entry_data.update(e.to_json(page.namespaces))
+            f.write(json.dumps(entry_data, separators=(",", ":")) + "\n")
+
+
+def history_value(entry):
+    """ Short description of entry value for history """
+    entry_type = entry.type_name
+    if entry_type in ["BLOB", "BLOB_DATA"]:
+        return "{} bytes".format(entry.fields["entry_data_size"])
+    if entry_type == "BLOB_IDX":
+        start = entry.fields["entry_data_chunk_start"]
+        return "{} bytes, chunks {}..{}".format(entry.fields["entry_data_size"], start, start + entry.fields["entry_data_chunk_count"] - 1)
+    return entry.fields.get("entry_data", None)
+
+def nvs_render_history(nvs, f, ndjson=False):
+    """ Versions of every key (NvsPartition) grouped by namespace and key, oldest first:
+        text timeline or one json line per version
+    """
+    for (ns, key) in sorted(nvs.versions):
+        versions = nvs.versions[(ns, key)]
+        if not ndjson:
+            print("{} : {}".format(nvs.namespaces.get(ns, ns) if ns != 0 else "<namespaces>", key), file=f)
+        for n, (page, e) in enumerate(versions):
+            if ndjson:
+                entry_data = { "version": n, "page_index": page.index, "page_state": page.state, "page_seq_no": page.seq_no, "entry_index": e.index }
+                entry_data.update(e.to_json(nvs.namespaces))
+                f.write(json.dumps(entry_data, separators=(",", ":")) + "\n")
                 continue
-            # if p_entry_state!="Written":
-            p_entry_type = p["entry_type"]
-            p_entry_data = p.get("entry_data",None)
-            p_entry_span  = p["entry_span"]
-            p_chunk_index = p["entry_chunk_index"]
-            p_entry_key   = p["entry_key"]
-            p_entry_data_type = p["entry_data_type"]
-            p_entry_data_size = p.get("entry_data_size", None)
-            #p_entry_data_chunk_count = p["entry_data_chunk_count"]
-            #p_entry_data_chunk_start = p["entry_data_chunk_start"]
+            print("  seq {:<6} page {:<3} entry {:<3} {:<7} {:<9}{} : {}".format(
+                page.seq_no, page.index, e.index, e.state, e.type_name,
+                " chunk {}".format(e.chunk_index) if e.type_name == "BLOB_DATA" else "", history_value(e)), file=f)
+
+
+def nvs_render_verify(nvs, f):
+    """ Report of pages and entries failed CRC32 check or with unknown page state (nvs parsed with verify), returns their number """
+    bad = nvs.corrupt()
+    for page, e in bad:
+        if e is None:
+            problems = []
+            if page.state == "UNKNOWN":
+                problems.append("unknown state {}".format(ASHEX(page.raw[0:4])))
+            if page.crc_ok is False:
+                problems.append("header CRC32 mismatch")
+            print("Page {} ( offset={:08x} ) : {}".format(page.index, page.offset, ", ".join(problems)), file=f)
+            continue
+        key = bytes(e.raw[8:24]).split(b'\0', 1)[0].decode('latin-1')
+        checks = [ name for name, ok in (("entry", e.crc_ok), ("data", e.data_crc_ok)) if ok is False ]
+        print("Page {} Entry {} (offset = {:08x}) {} {} ns={} key={} : {} CRC32 mismatch".format(
+            page.index, e.index, e.offset, e.state, e.type_name, e.ns, key, " and ".join(checks)), file=f)
+    print("CRC32 check: {} pages, {} corrupt pages, {} corrupt entries".format(
+        len(nvs.pages), len([ page for page, e in bad if e is None ]), len([ e for page, e in bad if e is not None ])), file=f)
+    return len(bad)
+
+
+def nvs_render_cvs(nvs, f, blobdatadir = BLOB_DATA_DIR):
+    """ Written entries grouped by namespaces in nvs_partition_gen csv format,
+        big and multi chunk blobs are saved to blobdatadir
+    """
+    create_empty_dir(blobdatadir)
+
+    print("# NVS csv file", file=f)
+    print("key,type,encoding,value", file=f)
+
+    # written entries by namespace in order of pages
+    parsed = {}
+    for page in nvs.pages:
+        for e in page.entries:
+            if e.used and e.state=="Written" and e.ns!=0: #0 - new namespace
+                parsed.setdefault(e.ns, []).append(e)
+
+    for ni,nn in nvs.namespaces.items():
+        print("{},namespace,,".format(nn), file=f)
+        for p in parsed.get(ni, []):
+            p_entry_type = p.type_name
+            p_entry_data = p.fields.get("entry_data",None)
+            p_entry_key   = p.key
             if p_entry_type=="U8":
-                print("{},data,u8,{}".format(p_entry_key,p_entry_data))
+                print("{},data,u8,{}".format(p_entry_key,p_entry_data), file=f)
             elif p_entry_type=="I8":
-                print("{},data,i8,{}".format(p_entry_key,p_entry_data))
+                print("{},data,i8,{}".format(p_entry_key,p_entry_data), file=f)
             elif p_entry_type=="U16":
-                print("{},data,u16,{}".format(p_entry_key,p_entry_data))
+                print("{},data,u16,{}".format(p_entry_key,p_entry_data), file=f)
             elif p_entry_type=="I16":
-                print("{},data,i16,{}".format(p_entry_key,p_entry_data))
+                print("{},data,i16,{}".format(p_entry_key,p_entry_data), file=f)
             elif p_entry_type=="U32":
-                print("{},data,u32,{}".format(p_entry_key,p_entry_data))
+                print("{},data,u32,{}".format(p_entry_key,p_entry_data), file=f)
             elif p_entry_type=="I32":
-                print("{},data,i32,{}".format(p_entry_key,p_entry_data))
+                print("{},data,i32,{}".format(p_entry_key,p_entry_data), file=f)
             elif p_entry_type=="U64":
-                print("{},data,u64,{}".format(p_entry_key,p_entry_data))
+                print("{},data,u64,{}".format(p_entry_key,p_entry_data), file=f)
             elif p_entry_type=="I64":
-                print("{},data,i64,{}".format(p_entry_key,p_entry_data))
+                print("{},data,i64,{}".format(p_entry_key,p_entry_data), file=f)
             elif p_entry_type=="STR":
-                print("{},data,string,{}".format(p_entry_key,p_entry_data))
+                print("{},data,string,{}".format(p_entry_key,p_entry_data), file=f)
             elif p_entry_type=="BLOB":
-                print(p_entry_key,p)
-            elif p_entry_type=="BLOB_DATA": #data in base64
-                if p_chunk_index==0: #rest already processed
-                    # get all chunks with same name
-
-                    chsize, chunks = get_entries( parsed, p_entry_key, p_entry_type )
-                    data = bytes()
-                    for i,c in chunks.items():
-                        data += base64.b64decode( c["entry_data"] )
-
-                    if len(chunks)==1 and chsize<100:
-                        print("{},data,base64,{}".format(p_entry_key,p_entry_data))
-                    else:
-                        #print(data)
-                        fname = os.path.join(BLOB_DATA_DIR, p_entry_key+".bin")
-                        with open(fname,"wb+") as f:
-                            f.write(data)
-                        print("{},file,binary,{}".format(p_entry_key,fname))
+                print(p_entry_key,p.to_json(nvs.namespaces), file=f)
+            elif p_entry_type=="BLOB_DATA":
+                # blob of live BLOB_IDX is joined at its first chunk, chunks of other versions are skipped
+                idx = nvs.entries.get((p.ns, p_entry_key), None)
+                chunks = nvs.chunks[(p.ns, p_entry_key)]
+                if idx is None or idx.type_name != "BLOB_IDX" or p is not chunks.get(idx.fields["entry_data_chunk_start"]):
+                    continue
+                data = nvs_entry_value(idx, chunks)
+
+                if idx.fields["entry_data_chunk_count"]==1 and len(data)<100:
+                    print("{},data,base64,{}".format(p_entry_key,base64.b64encode(data).decode('ascii')), file=f)
+                else:
+                    fname = os.path.join(blobdatadir, p_entry_key+".bin")
+                    with open(fname,"wb+") as fblob:
+                        fblob.write(data)
+                    print("{},file,binary,{}".format(p_entry_key,fname), file=f)
 
             elif p_entry_type=="BLOB_IDX":
                 pass #just skip due to already parsed, blobs joined
-            elif p_entry_type=="ANY":
-                print(p_entry_key,p)
             else:
-                print(p)
+                print(p.to_json(nvs.namespaces), file=f)
                 assert(0)
 
-def nvs2cvs(fh, blobdatadir = "blob_data"):
-    global BLOB_DATA_DIR
-    BLOB_DATA_DIR = blobdatadir
-    create_empty_dir(BLOB_DATA_DIR)
-
-    fh.seek(0, os.SEEK_END)
-    file_len = fh.tell()
-
-    print("# NVS csv file")
-    print("key,type,encoding,value")
-
-    sector_pos = 0
-    x = 0
-
-    parsed = []
-    
-    while(sector_pos < file_len):
-
-        fh.seek(sector_pos)
-        
-
-        raw_page_state = fh.read(4)
-        raw_seq_no = fh.read(4)
-        raw_version = fh.read(1)
-
-        fh.read(19) # unused
-
-        ofs_crc_32 = fh.tell()
-        raw_crc_32 = fh.read(4)
-
-        entry_state_bitmap = fh.read(32)
-        entry_state_bitmap_decoded = ''
-
-        for entry_num in range(0, 126):
-            bitnum = entry_num * 2
-            byte_index = int(bitnum / 8)
-            temp = entry_state_bitmap[byte_index]
-            
-            temp = temp >> (6 - (bitnum % 8))
-            temp = temp & 3
-            entry_state_bitmap_decoded = entry_state_bitmap_decoded + str(temp)
-
-        sector_pos += 4096
-        x += 1
-
-        entries = []
-        entry_data = ''
-        for entry in entry_state_bitmap_decoded:
-            entry_data = fh.read(32)
-            entries.append(entry_data)
-        parsed += parse_nvs_entries(entries, entry_state_bitmap_decoded)
 
-    entries2cvs(parsed)
+def nvs2txt(fh, f=None):
+    """ Text dump of NVS partition to f (stdout by default), returns pages as json serializable list """
+    nvs = nvs_parse(fh)
+    nvs_render_text(nvs, f or sys.stdout)
+    return [ page.to_json() for page in nvs.pages ]
 
+def nvs2cvs(fh, blobdatadir = BLOB_DATA_DIR, f=None):
+    nvs_render_cvs(nvs_parse(fh), f or sys.stdout, blobdatadir)
     return True
 
 #parser = argparse.ArgumentParser()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import os
+import mmap
+import struct
+import bisect
+import hashlib
+import esp32cache
+
+# bump when format of compiled file changes
+SYMDB_VERSION = 1
+SYMDB_MAGIC = b"KSYM"
+SYMDB_SUFFIX = ".symdb"
+
+# magic, version, count, names size, source mtime (ns), source size, source SHA-256
+HEADER = struct.Struct("<4sIIIqQ32s")
+# address, size, type, binding, name offset
+RECORD = struct.Struct("<IIBBxxI")
+ORDER = struct.Struct("<I")
+
+SYM_TYPES = ["NOTYPE", "OBJECT", "FUNC", "FILE"]
+SYM_BINDS = ["LOCAL", "GLOBAL"]
+
+
+class SymbolDB(object):
+    """ Compiled symbols file: records in order of source lines, indices of records sorted
+        by address and zero terminated names, all read in place from memory mapped file.
+        Symbol is (name, address, size, type, binding) tuple.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, names_size = HEADER.unpack_from(self.mmap, 0)[:4]
+        if magic != SYMDB_MAGIC or version != SYMDB_VERSION:
+            raise ValueError("{}: not a symbols database".format(filename))
+        self.ofs_records = HEADER.size
+        self.ofs_order = self.ofs_records + self.count*RECORD.size
+        self.ofs_names = self.ofs_order + self.count*ORDER.size
+        self.addresses = _Addresses(self)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        addr, size, stype, sbind, name_ofs = RECORD.unpack_from(self.mmap, self.ofs_records + i*RECORD.size)
+        name_ofs += self.ofs_names
+        name = self.mmap[name_ofs:self.mmap.find(b'\0', name_ofs)].decode()
+        return name, addr, size, SYM_TYPES[stype], SYM_BINDS[sbind]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def by_address(self, n):
+        """ Symbol number n in order of addresses """
+        return self[ORDER.unpack_from(self.mmap, self.ofs_order + n*ORDER.size)[0]]
+
+    def lookup(self, addr):
+        """ Nearest symbol at or below addr (addr - symbol address is offset in it) or None """
+        n = bisect.bisect_right(self.addresses, addr)
+        return self.by_address(n-1) if n > 0 else None
+
+    def close(self):
+        self.mmap.close()
+
+
+class _Addresses(object):
+    """ Sequence of symbols addresses in sorted order, for bisect """
+    def __init__(self, db):
+        self.db = db
+
+    def __len__(self):
+        return self.db.count
+
+    def __getitem__(self, n):
+        i = ORDER.unpack_from(self.db.mmap, self.db.ofs_order + n*ORDER.size)[0]
+        return RECORD.unpack_from(self.db.mmap, self.db.ofs_records + i*RECORD.size)[0]
+
+
+def parse_symbols(filename):
+    """ Symbols from readelf -s like listing: [(name, address, size, type, binding)] """
+    symbols = []
+    with open(filename, "rt") as fh:
+        for line in fh:
+            line = line.split()
+            if not line:
+                continue
+            symbols.append((line[7], int(line[1], 16), int(line[2]), line[3], line[4]))
+    return symbols
+
+
+def compile_symbols(filename, dbname):
+    """ Parse symbols file and save compiled database, written aside and renamed """
+    with open(filename, "rb") as f:
+        source = f.read()
+    st = os.stat(filename)
+    symbols = parse_symbols(filename)
+
+    records = bytearray()
+    names = bytearray()
+    for name, addr, size, stype, sbind in symbols:
+        records += RECORD.pack(addr, size, SYM_TYPES.index(stype), SYM_BINDS.index(sbind), len(names))
+        names += name.encode() + b'\0'
+    order = sorted(range(len(symbols)), key=lambda i: symbols[i][1])
+
+    tmpname = "{}.tmp.{}".format(dbname, os.getpid())
+    with open(tmpname, "wb") as f:
+        f.write(HEADER.pack(SYMDB_MAGIC, SYMDB_VERSION, len(symbols), len(names), st.st_mtime_ns, st.st_size, hashlib.sha256(source).digest()))
+        f.write(records)
+        f.write(b''.join( ORDER.pack(i) for i in order ))
+        f.write(names)
+    os.replace(tmpname, dbname)
+
+
+def is_actual(filename, dbname):
+    """ Compiled database matches symbols file: by mtime and size, or by SHA-256 if they differ
+        (then the header is restamped with current mtime and size)
+    """
+    try:
+        with open(dbname, "rb") as f:
+            header = f.read(HEADER.size)
+        magic, version, count, names_size, mtime, size, digest = HEADER.unpack(header)
+        st = os.stat(filename)
+    except (OSError, struct.error):
+        return False
+    if magic != SYMDB_MAGIC or version != SYMDB_VERSION:
+        return False
+    if (mtime, size) == (st.st_mtime_ns, st.st_size):
+        return True
+    with open(filename, "rb") as f:
+        if hashlib.sha256(f.read()).digest() != digest:
+            return False
+    # same contents (file was touched or copied), restamp so next runs pass by mtime and size
+    try:
+        with open(dbname, "r+b") as f:
+            f.write(HEADER.pack(magic, version, count, names_size, st.st_mtime_ns, st.st_size, digest))
+    except OSError:
+        pass
+    return True
+
+
+# opened databases of this process by symbols file name
+databases = {}
+
+def load_symbols(filename):
+    """ SymbolDB of symbols file, compiled beside it (or to cache dir if board is read-only) when missing or outdated """
+    db = databases.get(filename, None)
+    if db is not None:
+        return db
+    dbname = filename + SYMDB_SUFFIX
+    if not is_actual(filename, dbname):
+        try:
+            compile_symbols(filename, dbname)
+        except OSError:
+            # board directory is not writable
+            dbname = os.path.join(esp32cache.CACHE_DIR_DEFAULT, "symdb", hashlib.sha256(os.path.abspath(filename).encode()).hexdigest() + SYMDB_SUFFIX)
+            if not is_actual(filename, dbname):
+                os.makedirs(os.path.dirname(dbname), exist_ok=True)
+                compile_symbols(filename, dbname)
+    db = SymbolDB(dbname)
+    databases[filename] = db
+    return db
@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import os
+import mmap
 
 def hexify(bitstring, separator=""):
     try:
@@ -19,3 +21,55 @@ def align_file_position(f, size):
     """ Align the position in the file to the next block of specified size """
     align = (size - 1) - (f.tell() % size)
     f.seek(align, 1)
+
+
+class MappedFile(object):
+    """ Read-only memory mapping of a binary file.
+        `view` is a memoryview over the whole file, slicing it never copies data.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.mmap = None
+        self.view = memoryview(b'')
+        if os.fstat(self.file.fileno()).st_size > 0: # empty files can't be mapped
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.mmap)
+
+    def __len__(self):
+        return len(self.view)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                pass # slices are still alive, mapping is dropped with the last of them
+            self.mmap = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def as_buffer(data):
+    """ Return a memoryview over bytes-like object or MappedFile without copying it.
+        Opened binary file is read whole (its position is kept), map it with MappedFile to avoid the copy.
+    """
+    if isinstance(data, MappedFile):
+        return data.view
+    if hasattr(data, "getbuffer"): # io.BytesIO
+        return data.getbuffer()
+    if hasattr(data, "read"):
+        pos = data.tell()
+        data.seek(0)
+        content = data.read()
+        data.seek(pos)
+        return memoryview(content)
+    return memoryview(data)
@@ -3,12 +3,26 @@
 BASEDIR_DIS = "parsed"
 #BASEFILE = ""
 
-FILE_EFUSES_TXT = "{}/efuses".format(BASEDIR_DIS)
-FILE_FIRMWARE = "{}/firmware.bin".format(BASEDIR_DIS)
-FILE_LOGNAME = "{}/knife.log".format(BASEDIR_DIS)
-FILE_BOOTLOADER = "{}/bootloader.bin".format(BASEDIR_DIS)
-FILE_PARTITIONS_CSV = "{}/partitions.csv".format(BASEDIR_DIS)
-FILE_PARTITIONS_BIN = "{}/partitions.bin".format(BASEDIR_DIS)
-FILE_PARTITIONS = "{}/part".format(BASEDIR_DIS)
-
-NVS_BLOB_DATA_DIR = BASEDIR_DIS+"/nvs_blob_data"
+FILE_BATCH_INDEX = "batch_index.json"
+
+# interrupted device read, kept outside of output directory to survive restart
+FILE_PARTIAL = "firmware_{}.partial"
+
+def set_basedir(basedir):
+    """ (Re)define output file names relative to basedir """
+    global BASEDIR_DIS, FILE_EFUSES_TXT, FILE_FIRMWARE, FILE_LOGNAME, FILE_BOOTLOADER
+    global FILE_PARTITIONS_CSV, FILE_PARTITIONS_BIN, FILE_PARTITIONS, NVS_BLOB_DATA_DIR
+
+    BASEDIR_DIS = basedir
+
+    FILE_EFUSES_TXT = "{}/efuses".format(BASEDIR_DIS)
+    FILE_FIRMWARE = "{}/firmware.bin".format(BASEDIR_DIS)
+    FILE_LOGNAME = "{}/knife.log".format(BASEDIR_DIS)
+    FILE_BOOTLOADER = "{}/bootloader.bin".format(BASEDIR_DIS)
+    FILE_PARTITIONS_CSV = "{}/partitions.csv".format(BASEDIR_DIS)
+    FILE_PARTITIONS_BIN = "{}/partitions.bin".format(BASEDIR_DIS)
+    FILE_PARTITIONS = "{}/part".format(BASEDIR_DIS)
+
+    NVS_BLOB_DATA_DIR = BASEDIR_DIS+"/nvs_blob_data"
+
+set_basedir(BASEDIR_DIS)
@@ -1,9 +1,19 @@
 #!/usr/bin/env python3
+import sys
+import io
+import contextlib
+import threading
 
 FILE_LOG = None
+# capture buffer of thread, see log_capture()
+_capture = threading.local()
 
 def printlog(*args, **kwargs):
     global FILE_LOG
+    output = getattr(_capture, "output", None)
+    if output is not None:
+        print(*args, file=output, **kwargs)
+        return
     print(*args, **kwargs)
     if FILE_LOG:
         kwargs['file']=FILE_LOG
@@ -22,4 +32,27 @@ def log_close():
     global FILE_LOG
     if FILE_LOG:
         FILE_LOG.close()
-        FILE_LOG = None
\ No newline at end of file
+        FILE_LOG = None
+
+def log_flush():
+    sys.stdout.flush()
+    if FILE_LOG:
+        FILE_LOG.flush()
+
+def log_detach():
+    """ Stop writing to log file inherited from parent process """
+    global FILE_LOG
+    FILE_LOG = None
+
+@contextlib.contextmanager
+def log_capture():
+    """ Collect printlog() output of the block into string buffer instead of stdout and log file.
+        Only the calling thread is captured, output of other threads (flash reader) goes on as usual.
+    """
+    saved = getattr(_capture, "output", None)
+    output = io.StringIO()
+    _capture.output = output
+    try:
+        yield output
+    finally:
+        _capture.output = saved
@@ -5,32 +5,221 @@ import base64
 import binascii
 import argparse
 import json
+import glob
+import io
+import concurrent.futures
 from hexdump import hexdump
 from esp32nvs import *
+from esp32utils import MappedFile
 
 
-def main():
-  parser = argparse.ArgumentParser()
+def main_get(argv):
+  parser = argparse.ArgumentParser(prog="nvs2cvs.py get", description="Print live value of one key")
   parser.add_argument("nvs_bin_file", help="nvs partition binary file", type=str)
-  parser.add_argument("--type", "-t", help="output type", type=str, choices=["cvs", "text", "json"], default="cvs")
+  parser.add_argument("namespace", help="namespace name", type=str)
+  parser.add_argument("key", help="key name", type=str)
+  parser.add_argument("--output", "-o", help="write value (binary for blobs) to file", type=str, default=None)
+
+  args = parser.parse_args(argv)
+
+  with MappedFile(args.nvs_bin_file) as fh:
+    value = nvs_get(fh, args.namespace, args.key)
+  if value is None:
+    print("{}:{} not found".format(args.namespace, args.key), file=sys.stderr)
+    sys.exit(1)
+
+  if args.output:
+    with open(args.output, "wb") as f:
+      f.write(value if isinstance(value, bytes) else str(value).encode())
+  elif isinstance(value, bytes):
+    print(base64.b64encode(value).decode('ascii'))
+  else:
+    print(value)
+
+
+OUTPUT_SUFFIX = { "cvs": ".cvs", "text": ".txt", "json": ".json", "ndjson": ".ndjson" }
+
+
+def nvs_files(inputs):
+  """ Expand directories and glob patterns to the list of nvs files """
+  files = []
+  for i in inputs:
+    if os.path.isdir(i):
+      names = [ os.path.join(i, f) for f in sorted(os.listdir(i)) ]
+    else:
+      names = sorted(glob.glob(i)) or [i]
+    for f in names:
+      if (os.path.isfile(f) or not os.path.exists(f)) and f not in files:
+        files.append(f)
+  return files
+
+
+def output_names(files):
+  """ Output name per file, duplicated names get index suffix """
+  names = []
+  for f in files:
+    name = os.path.basename(f)
+    n = 1
+    while name in names:
+      name = "{}.{}".format(os.path.basename(f), n)
+      n += 1
+    names.append(name)
+  return names
 
-  args = parser.parse_args()
 
-  with open(args.nvs_bin_file, 'rb') as fh:
-    if args.type == "cvs":
-      nvs2cvs(fh)
-    elif args.type == "text":
-      pages = nvs2txt(fh)
-      sys.stdout = sys.stdout = sys.__stdout__ # re-enable print()
-    elif args.type == "json":
-      sys.stdout = open(os.devnull, 'w') # block print()
-      pages = nvs2txt(fh)
-      sys.stdout = sys.stdout = sys.__stdout__ # re-enable print()
-      print(json.dumps(pages, indent=4))
+def tag_ndjson(text, source, f):
+  """ Add source field to every json line """
+  prefix = '{{"source":{},'.format(json.dumps(source))
+  for line in text.splitlines():
+    print(prefix + line[1:], file=f)
+
+
+def render_file(fname, otype, verify, compact, f, blobdatadir=BLOB_DATA_DIR, source=None, history=False):
+  """ Render one nvs file to f, with source set every csv line / ndjson record is tagged by it.
+      history - versions of every key, ndjson for ndjson type, text for the rest
+  """
+  with MappedFile(fname) as fh:
+    if history:
+      if source is None:
+        nvs_render_history(nvs_parse(fh, verify=verify), f, otype == "ndjson")
+        return
+      buf = io.StringIO()
+      nvs_render_history(nvs_parse(fh, verify=verify), buf, True)
+      tag_ndjson(buf.getvalue(), source, f)
+    elif otype == "cvs":
+      if source is None:
+        nvs_render_cvs(nvs_parse(fh, verify=verify), f, blobdatadir)
+        return
+      buf = io.StringIO()
+      nvs_render_cvs(nvs_parse(fh, verify=verify), buf, blobdatadir)
+      # skip per file header, merged one is written once
+      for line in buf.getvalue().splitlines()[2:]:
+        print("{},{}".format(source, line), file=f)
+    # the rest are written while pages are parsed
+    elif otype == "text":
+      nvs_render_text(nvs_pages(fh, verify=verify), f)
+    elif otype == "json":
+      nvs_render_json(nvs_pages(fh, verify=verify), f, compact)
+      print("", file=f)
+    elif otype == "ndjson":
+      if source is None:
+        nvs_render_ndjson(nvs_pages(fh, verify=verify), f)
+        return
+      buf = io.StringIO()
+      nvs_render_ndjson(nvs_pages(fh, verify=verify), buf)
+      tag_ndjson(buf.getvalue(), source, f)
     else:
       assert(0)
 
 
+def _nvs_file_job(fname, name, args):
+  """ Pool worker: one nvs file to own output file or to text merged by parent, errors are reported in result """
+  result = { "file": fname, "status": "failed", "error": None, "output": None, "corrupt": 0 }
+  try:
+    if args.verify_only:
+      buf = io.StringIO()
+      with MappedFile(fname) as fh:
+        result["corrupt"] = nvs_render_verify(nvs_parse(fh, verify=True, decode=False), buf)
+      result["output"] = buf.getvalue()
+    elif args.output_dir:
+      if args.history:
+        fout = os.path.join(args.output_dir, name + ".history" + (".ndjson" if args.type == "ndjson" else ".txt"))
+      else:
+        fout = os.path.join(args.output_dir, name + OUTPUT_SUFFIX[args.type])
+      with open(fout, "wt") as f:
+        render_file(fname, args.type, args.verify, args.compact, f, os.path.join(args.output_dir, name + ".blob_data"), history=args.history)
+      result["output"] = fout
+    else:
+      buf = io.StringIO()
+      render_file(fname, args.type, args.verify, args.compact, buf, os.path.join(BLOB_DATA_DIR, name), source=fname, history=args.history)
+      result["output"] = buf.getvalue()
+    result["status"] = "ok"
+  except Exception as inst:
+    result["error"] = "{}: {}".format(type(inst).__name__, inst)
+  return result
+
+
+def main_many(files, args):
+  """ Parse nvs files in worker processes, outputs and progress are written in order of files """
+  names = output_names(files)
+  if args.output_dir:
+    os.makedirs(args.output_dir, exist_ok=True)
+  elif not args.verify_only and not args.history and args.type == "cvs":
+    print("# NVS csv file")
+    print("source,key,type,encoding,value")
+
+  results = [None] * len(files)
+  written = 0
+  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+    # largest files first, so the tail is made of the short ones
+    order = sorted(range(len(files)), key=lambda i: os.path.getsize(files[i]) if os.path.isfile(files[i]) else 0, reverse=True)
+    futures = { pool.submit(_nvs_file_job, files[i], names[i], args): i for i in order }
+    for future in concurrent.futures.as_completed(futures):
+      i = futures[future]
+      try:
+        results[i] = future.result()
+      except Exception as inst: # worker died
+        results[i] = { "file": files[i], "status": "failed", "error": "{}: {}".format(type(inst).__name__, inst), "output": None, "corrupt": 0 }
+      # flush finished prefix, so output does not depend on completion order
+      while written < len(files) and results[written] is not None:
+        r = results[written]
+        written += 1
+        if r["status"] == "ok" and not args.output_dir:
+          if args.verify_only:
+            if r["corrupt"]:
+              print("{}:".format(r["file"]))
+              sys.stdout.write("".join("  " + line + "\n" for line in r["output"].splitlines()))
+          else:
+            sys.stdout.write(r["output"])
+          r["output"] = None
+        print("[{}/{}] {} : {}".format(written, len(files), r["file"], r["error"] or (r["status"] if not r["corrupt"] else "corrupt")), file=sys.stderr)
+
+  failed = [ r for r in results if r["status"] != "ok" ]
+  corrupt = [ r for r in results if r["corrupt"] ]
+  print("Done: {} files, {} ok, {} failed".format(len(results), len(results)-len(failed), len(failed))
+        + (", {} corrupt".format(len(corrupt)) if args.verify_only else ""), file=sys.stderr)
+  for r in failed:
+    print("  {} : {}".format(r["file"], r["error"]), file=sys.stderr)
+  if failed or corrupt:
+    sys.exit(1)
+
+
+def main():
+  if len(sys.argv) > 1 and sys.argv[1] == "get":
+    main_get(sys.argv[2:])
+    return
+
+  parser = argparse.ArgumentParser(epilog="nvs2cvs.py get nvs_bin_file namespace key - print one value")
+  parser.add_argument("nvs_bin_file", help="nvs partition binary file(s), directories or glob patterns", type=str, nargs="+")
+  parser.add_argument("--type", "-t", help="output type", type=str, choices=["cvs", "text", "json", "ndjson"], default="cvs")
+  parser.add_argument("--compact", help="json without indentation", action="store_true")
+  parser.add_argument("--verify", help="check CRC32 of pages and entries, results are added to text/json output", action="store_true")
+  parser.add_argument("--verify-only", "--verify_only", help="only check CRC32 of pages and entries, exit code 1 if corrupt", action="store_true")
+
+  parser.add_argument("--history", help="all versions (written and erased) of every key ordered by page seq no, ndjson for -t=ndjson, text otherwise", action="store_true")
+  parser.add_argument("--output_dir", "--output-dir", "-o", help="write output of every file to own <name>.<type> file in this directory", type=str, default=None)
+  parser.add_argument("--jobs", "-j", help="number of worker processes for many files", type=int, default=os.cpu_count() or 1)
+
+  args = parser.parse_args()
+
+  files = nvs_files(args.nvs_bin_file)
+  if len(files) != 1 or args.output_dir or os.path.isdir(args.nvs_bin_file[0]):
+    if not files:
+      parser.error("no nvs files found")
+    if not (args.output_dir or args.verify_only) and args.type not in (("ndjson",) if args.history else ("cvs", "ndjson")):
+      parser.error("many files can be merged only to cvs or ndjson (ndjson for history), use --output_dir for {}".format(args.type))
+    main_many(files, args)
+    return
+
+  if args.verify_only:
+    with MappedFile(files[0]) as fh:
+      if nvs_render_verify(nvs_parse(fh, verify=True, decode=False), sys.stdout):
+        sys.exit(1)
+    return
+
+  render_file(files[0], args.type, args.verify, args.compact, sys.stdout, history=args.history)
+
+
 def _main():
     try:
         main()
@@ -38,6 +227,7 @@ def _main():
         print(type(inst))
         print(inst.args)
         print(inst)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
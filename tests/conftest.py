@@ -0,0 +1,21 @@
+import os, sys
+import subprocess
+
+import pytest
+
+# modules are flat in repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+@pytest.fixture
+def make_nvs(tmp_path):
+    """ Builds NVS partition from csv rows with esp_idf_nvs_partition_gen, returns its file name """
+    pytest.importorskip("esp_idf_nvs_partition_gen")
+    def make(name, rows, size=0x3000):
+        csv = tmp_path / (name + ".csv")
+        csv.write_text("\n".join(["key,type,encoding,value"] + rows) + "\n")
+        out = tmp_path / (name + ".bin")
+        subprocess.run([sys.executable, "-m", "esp_idf_nvs_partition_gen", "generate", str(csv), str(out), hex(size)],
+                       check=True, stdout=subprocess.DEVNULL, cwd=str(tmp_path))
+        return str(out)
+    return make
@@ -0,0 +1,33 @@
+import os
+
+import esp32cache
+
+
+def store_entries(cache, tmp_path, count, size=1000):
+    fname = str(tmp_path / "part")
+    for n in range(count):
+        with open(fname + ".elf", "wb") as f:
+            f.write(n.to_bytes(4, "little") * (size // 4))
+        cache.store("{:064x}".format(n), fname, [".elf"], { "log": "" })
+
+
+def cache_size(root):
+    return sum( os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files )
+
+
+def test_store_scans_cache_once_within_budget(tmp_path, monkeypatch):
+    cache = esp32cache.AnalysisCache(str(tmp_path / "cache"), 1024*1024)
+    scans = []
+    evict = esp32cache.AnalysisCache.evict
+    monkeypatch.setattr(esp32cache.AnalysisCache, "evict", lambda self: (scans.append(1), evict(self)))
+    store_entries(cache, tmp_path, 50)
+    assert len(scans) == 1
+    assert cache.size == cache_size(cache.root)
+
+
+def test_store_evicts_over_budget(tmp_path):
+    cache = esp32cache.AnalysisCache(str(tmp_path / "cache"), 10000)
+    store_entries(cache, tmp_path, 50)
+    assert cache.size == cache_size(cache.root) <= 10000
+    assert cache.load("{:064x}".format(49), str(tmp_path / "restored")) is not None # newest kept
+    assert cache.load("{:064x}".format(0), str(tmp_path / "restored")) is None
@@ -0,0 +1,17 @@
+import esp32elf
+
+
+def test_section_by_name_whole_names(tmp_path):
+    elf = esp32elf.ElfWriter(94)
+    iram = elf.add_section(".iram0.text", [b"\x01\x02"], 0x40080000)
+    text = elf.add_section(".text", [b"\x03"], 0x400d0000) # suffix of the name above
+    assert elf.section_by_name(".iram0.text") == iram
+    assert elf.section_by_name(".text") == text
+
+    elf.add_segment(text, 0x400d0000, 1, 5, 0x1000)
+    elf.write(str(tmp_path / "out.elf"))
+    data = (tmp_path / "out.elf").read_bytes()
+    shoff = esp32elf.EHDR.unpack_from(data)[6]
+    name_off = esp32elf.SHDR.unpack_from(data, shoff + text*esp32elf.SHDR.size)[0]
+    shstrtab = esp32elf.SHDR.unpack_from(data, shoff + esp32elf.SHDR.size)[4]
+    assert data[shstrtab+name_off:].split(b"\0", 1)[0] == b".text"
@@ -0,0 +1,90 @@
+import io
+
+import esp32nvs
+
+
+def blob_partition(make_nvs, tmp_path):
+    (tmp_path / "big.bin").write_bytes(bytes( i*7 & 0xff for i in range(5000) ))
+    rows = ["wifi,namespace,,", "ssid,data,string,MyNetwork", "chan,data,u8,6",
+            "cal,namespace,,", "small,data,hex2bin,0123456789abcdef", "big,file,binary,big.bin"]
+    return make_nvs("blob", rows, 0x6000)
+
+
+def test_blob_index_fields(make_nvs, tmp_path):
+    with open(blob_partition(make_nvs, tmp_path), "rb") as fh:
+        nvs = esp32nvs.nvs_parse(fh)
+    idx = nvs.entries[(nvs.namespace_ids["cal"], "big")]
+    assert idx.type_name == "BLOB_IDX"
+    chunks = nvs.blob_chunks(idx.ns, "big")
+    assert idx.fields["entry_data_size"] == 5000
+    assert idx.fields["entry_data_chunk_count"] == len(chunks) > 1
+    assert idx.fields["entry_data_chunk_start"] == 0
+    assert nvs.get("cal", "big") == (tmp_path / "big.bin").read_bytes()
+    assert nvs.get("cal", "small") == bytes.fromhex("0123456789abcdef")
+    assert esp32nvs.history_value(idx) == "5000 bytes, chunks 0..{}".format(len(chunks) - 1)
+
+
+def test_get_matches_full_model(make_nvs, tmp_path):
+    rows = ["wifi,namespace,,"] + [ "k{},data,u32,{}".format(i, i) for i in range(200) ] + ["cnt,data,i32,-7"]
+    for fname in (blob_partition(make_nvs, tmp_path), make_nvs("many", rows)):
+        with open(fname, "rb") as fh:
+            data = fh.read()
+        nvs = esp32nvs.nvs_parse(data)
+        keys = [ (nvs.namespaces[ns], key) for ns, key in nvs.versions if ns != 0 ] + [("wifi", "nokey"), ("nons", "k0")]
+        for ns, key in keys:
+            assert esp32nvs.nvs_get(data, ns, key) == nvs.get(ns, key)
+
+
+def test_get_stops_at_newest_entry(make_nvs, monkeypatch):
+    rows = ["wifi,namespace,,"] + [ "k{},data,u32,{}".format(i, i) for i in range(200) ]
+    with open(make_nvs("many", rows), "rb") as fh:
+        data = fh.read()
+    parsed = []
+    page_init = esp32nvs.NvsPage.__init__
+    monkeypatch.setattr(esp32nvs.NvsPage, "__init__", lambda self, index, *args: (parsed.append(index), page_init(self, index, *args))[1])
+    assert esp32nvs.nvs_get(data, "wifi", "k0") == 0
+    assert parsed == [0] # namespace and key are on the first page, the rest are not parsed
+
+
+def blob_entries(data, ns, key):
+    """ Offsets of BLOB_DATA entries and of BLOB_IDX entry of key in partition """
+    nvs = esp32nvs.nvs_parse(bytes(data))
+    chunks = [ e.offset for e in nvs.blob_chunks(nvs.namespace_ids[ns], key) ]
+    return chunks, nvs.entries[(nvs.namespace_ids[ns], key)].offset
+
+
+def render_cvs(data, blobdatadir):
+    out = io.StringIO()
+    esp32nvs.nvs_render_cvs(esp32nvs.nvs_parse(bytes(data)), out, blobdatadir)
+    return out.getvalue().splitlines()
+
+
+def test_cvs_blob_version_1(make_nvs, tmp_path):
+    with open(blob_partition(make_nvs, tmp_path), "rb") as fh:
+        data = bytearray(fh.read())
+    (chunk,), idx = blob_entries(data, "cal", "small")
+    # blob rewritten once on device: chunks are at VER_1 offset 128
+    data[chunk+3] = 128
+    data[idx+29] = 128
+    assert esp32nvs.nvs_parse(bytes(data)).get("cal", "small") == bytes.fromhex("0123456789abcdef")
+    assert "small,data,base64,ASNFZ4mrze8=" in render_cvs(data, str(tmp_path / "blobs"))
+
+
+def test_cvs_blob_stale_version(make_nvs, tmp_path):
+    with open(blob_partition(make_nvs, tmp_path), "rb") as fh:
+        data = bytearray(fh.read())
+    (chunk,), idx = blob_entries(data, "cal", "small")
+    # stale chunk of the other version in the first two free entries
+    nvs = esp32nvs.nvs_parse(bytes(data))
+    page, i = next( (p.offset, e.index) for p in nvs.pages if p.state != "EMPTY"
+                    for e, n in zip(p.entries, p.entries[1:]) if e.state == n.state == "Empty" and n.index == e.index+1 )
+    stale = page + 64 + i*32
+    data[stale:stale+32] = data[chunk:chunk+32]
+    data[stale+3] = 128
+    data[stale+32:stale+40] = b"stalever"
+    for n in (i, i+1):
+        data[page+32 + n//4] &= ~(1 << (n%4)*2) & 0xff # 3 (empty) -> 2 (written)
+
+    lines = render_cvs(data, str(tmp_path / "blobs"))
+    assert [ l for l in lines if l.startswith("small,") ] == ["small,data,base64,ASNFZ4mrze8="]
+    assert esp32nvs.nvs_parse(bytes(data)).get("cal", "small") == bytes.fromhex("0123456789abcdef")
@@ -0,0 +1,54 @@
+import io
+import os
+import concurrent.futures
+
+import esp32nvs
+
+
+def partitions(make_nvs, tmp_path):
+    """ Partitions with different namespaces tables: ints, strings, small and multi chunk blobs """
+    (tmp_path / "big.bin").write_bytes(bytes( i*7 & 0xff for i in range(5000) ))
+    files = []
+    for n in range(4):
+        rows = []
+        for ns in range(n+1):
+            rows.append("ns{}_{},namespace,,".format(n, ns))
+            rows += [ "u{},data,u32,{}".format(i, i*1000+n) for i in range(20+n*10) ]
+            rows += [ "s{},data,string,value {} of {}".format(i, i, ns) for i in range(n+2) ]
+            rows.append("b,data,hex2bin,{}".format("0123456789abcdef"*(n+1)))
+        rows.append("big,file,binary,big.bin")
+        files.append(make_nvs("p{}".format(n), rows, 0x6000))
+    return files
+
+
+def render(fname, blobdatadir):
+    """ text, json and csv renders of partition parsed by own NvsParser """
+    with open(fname, "rb") as fh:
+        data = fh.read()
+    parser = esp32nvs.NvsParser(verify=True)
+    nvs = parser.parse(data)
+    out = []
+    for f in (lambda f: esp32nvs.nvs_render_text(nvs.pages, f),
+              lambda f: esp32nvs.nvs_render_json(nvs.pages, f),
+              lambda f: esp32nvs.nvs_render_cvs(nvs, f, blobdatadir)):
+        s = io.StringIO()
+        f(s)
+        out.append(s.getvalue().replace(blobdatadir, "BLOBS").encode())
+    blobs = { name: open(os.path.join(blobdatadir, name), "rb").read() for name in sorted(os.listdir(blobdatadir)) }
+    return out, blobs
+
+
+def test_parallel_parsers_match_serial(make_nvs, tmp_path):
+    files = partitions(make_nvs, tmp_path)
+    serial = [ render(fname, str(tmp_path / "serial{}".format(n))) for n, fname in enumerate(files) ]
+    for n, (out, blobs) in enumerate(serial):
+        # namespaces of other partitions do not leak into this one
+        assert out[2].count(b",namespace,,") == n+1
+        assert "ns{}_{},namespace,,".format(n, n).encode() in out[2]
+        assert "big.bin" in blobs # multi chunk blob
+
+    jobs = [ (n % len(files), str(tmp_path / "thread{}".format(n))) for n in range(len(files)*6) ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda job: render(files[job[0]], job[1]), jobs))
+    for (n, _), result in zip(jobs, results):
+        assert result == serial[n]
@@ -0,0 +1,26 @@
+import esp32nvs
+
+
+def test_entry_states_little_endian():
+    # entries 0, 1 written, 2, 3 empty: state of entry i is at bits (i%4)*2
+    bitmap = bytes([0xFA]) + b'\xff'*31
+    assert esp32nvs.decode_entry_state_bitmap(bitmap)[:8] == "22333333"
+    bitmap = bytes([0x08]) + b'\xff'*31 # entry 0 erased, 1 written, 2 and 3 erased
+    assert esp32nvs.decode_entry_state_bitmap(bitmap)[:4] == "0200"
+
+
+def test_generated_partition(make_nvs):
+    # 105 entries, so the last bitmap byte of them is partially written
+    rows = ["wifi,namespace,,"]
+    rows += [ "k{},data,u8,{}".format(i, i) for i in range(103) ]
+    rows += [ "cnt,data,i32,-7" ]
+
+    with open(make_nvs("nvs", rows), "rb") as fh:
+        nvs = esp32nvs.nvs_parse(fh, verify=True)
+    used = [ e for page in nvs.pages for e in page.entries if e.used ]
+    assert len(used) == 105
+    assert all( e.state == "Written" for e in used )
+    assert not nvs.corrupt()
+    assert nvs.get("wifi", "cnt") == -7
+    assert [ nvs.get("wifi", "k{}".format(i)) for i in range(103) ] == list(range(103))
+    assert [ e.state for page, e in nvs.history("wifi", "cnt") ] == ["Written"]
@@ -0,0 +1,18 @@
+import io
+
+import esp32nvs
+
+
+def test_unknown_page_state_is_corrupt(make_nvs):
+    rows = ["wifi,namespace,,"] + [ "k{},data,u32,{}".format(i, i) for i in range(150) ]
+    with open(make_nvs("nvs", rows), "rb") as fh:
+        data = bytearray(fh.read())
+    assert not esp32nvs.nvs_parse(data, verify=True, decode=False).corrupt()
+
+    data[4096:4100] = (0x12).to_bytes(4, "little") # damaged state word of page 1
+    nvs = esp32nvs.nvs_parse(data, verify=True, decode=False)
+    assert nvs.pages[1].state == "UNKNOWN"
+    assert nvs.corrupt() == [(nvs.pages[1], None)]
+    report = io.StringIO()
+    assert esp32nvs.nvs_render_verify(nvs, report) == 1
+    assert "Page 1 ( offset=00001000 ) : unknown state" in report.getvalue()